@@ -49,7 +49,7 @@ class AuthTester:
         try:
             signup_data = {
                 "name": "Emma Rodriguez",
-                "email": "emma.rodriguez@example.com",
+                "email": f"emma.rodriguez+{uuid.uuid4().hex[:8]}@example.com",
                 "password": "SecurePass123!"
             }
             
@@ -99,6 +99,33 @@ class AuthTester:
             self.log_test("Auth Signup", False, f"Request error: {str(e)}")
             return False
 
+    def test_auth_signup_duplicate(self):
+        """Test POST /api/auth/signup with an email that is already registered"""
+        try:
+            signup_data = {
+                "name": "Emma Rodriguez",
+                "email": f"emma.rodriguez+{uuid.uuid4().hex[:8]}@example.com",
+                "password": "SecurePass123!"
+            }
+            
+            first = requests.post(f"{API_BASE_URL}/auth/signup", json=signup_data)
+            if first.status_code != 200:
+                self.log_test("Auth Signup Duplicate", False, f"First signup: HTTP {first.status_code}", first.text)
+                return False
+            
+            response = requests.post(f"{API_BASE_URL}/auth/signup", json=signup_data)
+            
+            if response.status_code == 409 and response.json().get("detail") == "Email already registered":
+                self.log_test("Auth Signup Duplicate", True, "Repeated signup rejected with HTTP 409")
+                return True
+            
+            self.log_test("Auth Signup Duplicate", False, f"Expected HTTP 409, got {response.status_code}", response.text)
+            return False
+                
+        except Exception as e:
+            self.log_test("Auth Signup Duplicate", False, f"Request error: {str(e)}")
+            return False
+
     def test_auth_login(self):
         """Test POST /api/auth/login"""
         try:
@@ -202,6 +229,7 @@ class AuthTester:
         # Test sequence
         tests = [
             ("Auth Signup", self.test_auth_signup),
+            ("Auth Signup Duplicate", self.test_auth_signup_duplicate),
             ("Auth Login", self.test_auth_login),
             ("Auth Logout", self.test_auth_logout)
         ]
@@ -0,0 +1,246 @@
+"""
+Local CoinMarketCap stand-in for offline load and latency testing.
+
+Implements the part of the CoinMarketCap Pro API that server.py uses:
+
+    GET /v1/cryptocurrency/quotes/latest   ?symbol=... or ?id=..., skip_invalid
+    GET /v1/cryptocurrency/map
+
+Latency, jitter, error rate, 429 bursts and partial-symbol responses are set with
+FAKE_CMC_* environment variables, or changed at runtime with POST /__fake/config.
+GET /__fake/stats reports what the backend asked for (requests, symbols, credits).
+
+    python fake_coinmarketcap.py --port 8765
+    COINMARKETCAP_BASE_URL=http://127.0.0.1:8765/v1 uvicorn server:app
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+ROOT_DIR = Path(__file__).parent
+
+# Listed coins come from the same seed map the backend resolves ids with
+SEED_MAP = ROOT_DIR / 'cmc_id_map.seed.json'
+
+# Rough starting prices; other coins get a stable pseudo-random price
+ANCHOR_PRICES = {"BTC": 65000.0, "ETH": 3200.0, "BNB": 580.0, "SOL": 150.0, "USDT": 1.0, "USDC": 1.0}
+
+
+@dataclass
+class FakeConfig:
+    """Behaviour knobs; every field can be set from FAKE_CMC_<FIELD> in the environment"""
+    latency: float = 0.05        # seconds added to every response
+    jitter: float = 0.0          # extra uniform random delay, 0..jitter seconds
+    error_rate: float = 0.0      # probability of a 500 response
+    burst_period: float = 0.0    # every burst_period seconds...
+    burst_length: float = 0.0    # ...the first burst_length seconds answer 429 (0 disables)
+    partial_rate: float = 0.0    # probability that a valid coin is left out of a response
+    volatility: float = 0.001    # stddev of the per-request log price move
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeConfig":
+        values = {}
+        for f in fields(cls):
+            raw = os.environ.get(f"FAKE_CMC_{f.name.upper()}")
+            if raw is not None:
+                values[f.name] = f.type(raw)
+        return cls(**values)
+
+    def update(self, values: dict):
+        for f in fields(self):
+            if f.name in values:
+                setattr(self, f.name, f.type(values[f.name]))
+
+
+class FakeMarket:
+    """Listed coins and their random-walk prices"""
+
+    def __init__(self, ids: Dict[str, int], config: FakeConfig):
+        self.config = config
+        self.ids = dict(ids)
+        self.symbols = {coin_id: symbol for symbol, coin_id in self.ids.items()}
+        self.rng = random.Random(config.seed)
+        self.started = time.monotonic()
+        self.prices = {symbol: self._initial_price(symbol) for symbol in self.ids}
+        self.stats = {"requests": 0, "quote_requests": 0, "map_requests": 0, "errors": 0,
+                      "rate_limited": 0, "invalid": 0, "symbols_requested": 0, "credits": 0}
+
+    @classmethod
+    def from_seed(cls, config: FakeConfig, path: Path = SEED_MAP) -> "FakeMarket":
+        with open(path) as f:
+            return cls(json.load(f)["ids"], config)
+
+    @staticmethod
+    def _initial_price(symbol: str) -> float:
+        if symbol in ANCHOR_PRICES:
+            return ANCHOR_PRICES[symbol]
+        # crc32 keeps prices stable across runs (hash() is salted per process)
+        return round(0.05 + (zlib.crc32(symbol.encode()) % 50000) / 100, 4)
+
+    def rank(self, symbol: str) -> int:
+        return sorted(self.ids, key=lambda s: -self.prices[s]).index(symbol) + 1
+
+    def quote(self, symbol: str) -> dict:
+        price = self.prices[symbol] * math.exp(self.rng.gauss(0.0, self.config.volatility))
+        self.prices[symbol] = price
+        initial = self._initial_price(symbol)
+        supply = 1.0e9 / max(initial, 1.0)
+        return {
+            "id": self.ids[symbol],
+            "name": symbol,
+            "symbol": symbol,
+            "last_updated": datetime.utcnow().isoformat() + "Z",
+            "quote": {"USD": {
+                "price": price,
+                "percent_change_24h": (price / initial - 1) * 100,
+                "market_cap": price * supply,
+                "volume_24h": price * supply * 0.05,
+                "last_updated": datetime.utcnow().isoformat() + "Z"
+            }}
+        }
+
+    def rate_limited(self) -> bool:
+        if self.config.burst_period <= 0 or self.config.burst_length <= 0:
+            return False
+        return (time.monotonic() - self.started) % self.config.burst_period < self.config.burst_length
+
+
+def status_body(error_code: int = 0, error_message: Optional[str] = None, credits: int = 0) -> dict:
+    return {"timestamp": datetime.utcnow().isoformat() + "Z", "error_code": error_code,
+            "error_message": error_message, "elapsed": 0, "credit_count": credits}
+
+
+def error_response(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"status": status_body(status_code, message)})
+
+
+def split_list(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def create_app(config: Optional[FakeConfig] = None, market: Optional[FakeMarket] = None) -> FastAPI:
+    config = config or FakeConfig.from_env()
+    market = market or FakeMarket.from_seed(config)
+    app = FastAPI(title="Fake CoinMarketCap")
+    app.state.config = config
+    app.state.market = market
+
+    async def simulate(kind: str) -> Optional[JSONResponse]:
+        """Apply latency and injected failures shared by all upstream endpoints"""
+        market.stats["requests"] += 1
+        market.stats[kind] += 1
+        delay = config.latency + (market.rng.uniform(0, config.jitter) if config.jitter > 0 else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if market.rate_limited():
+            market.stats["rate_limited"] += 1
+            return error_response(429, "You've exceeded your API Key's HTTP request rate limit.")
+        if config.error_rate > 0 and market.rng.random() < config.error_rate:
+            market.stats["errors"] += 1
+            return error_response(500, "An internal server error occurred")
+        return None
+
+    @app.get("/v1/cryptocurrency/quotes/latest")
+    async def quotes_latest(symbol: Optional[str] = None, id: Optional[str] = None,
+                            convert: str = "USD", skip_invalid: bool = False):
+        failure = await simulate("quote_requests")
+        if failure is not None:
+            return failure
+        if convert.upper() != "USD":
+            return error_response(400, f'Invalid value for "convert": "{convert}"')
+        if not symbol and not id:
+            return error_response(400, '"value" must contain at least one of [id, symbol, slug]')
+
+        # Data is keyed by id when requested by id, and by ticker otherwise (as upstream does)
+        if id:
+            keys = split_list(id)
+            coins = {key: market.symbols.get(int(key)) if key.isdigit() else None for key in keys}
+        else:
+            keys = [key.upper() for key in split_list(symbol)]
+            coins = {key: key if key in market.ids else None for key in keys}
+
+        invalid = [key for key, coin in coins.items() if coin is None]
+        if invalid and not skip_invalid:
+            market.stats["invalid"] += 1
+            field_name = "id" if id else "symbol"
+            return error_response(400, f'Invalid value for "{field_name}": "{",".join(invalid)}"')
+
+        market.stats["symbols_requested"] += len(keys)
+        credits = max(1, math.ceil(len(keys) / 100))
+        market.stats["credits"] += credits
+        data = {}
+        for key, coin in coins.items():
+            if coin is None:
+                continue
+            if config.partial_rate > 0 and market.rng.random() < config.partial_rate:
+                continue
+            data[key] = market.quote(coin)
+        return {"status": status_body(credits=credits), "data": data}
+
+    @app.get("/v1/cryptocurrency/map")
+    async def cryptocurrency_map():
+        failure = await simulate("map_requests")
+        if failure is not None:
+            return failure
+        data = [{"id": coin_id, "name": symbol, "symbol": symbol, "rank": market.rank(symbol), "is_active": 1}
+                for symbol, coin_id in market.ids.items()]
+        return {"status": status_body(credits=1), "data": data}
+
+    # Control endpoints for test scripts
+    @app.get("/__fake/stats")
+    async def fake_stats():
+        return {"config": asdict(config), "stats": dict(market.stats)}
+
+    @app.post("/__fake/config")
+    async def fake_config(request: Request):
+        config.update(await request.json())
+        return asdict(config)
+
+    @app.post("/__fake/reset")
+    async def fake_reset():
+        for key in market.stats:
+            market.stats[key] = 0
+        market.started = time.monotonic()
+        return dict(market.stats)
+
+    return app
+
+
+def serve_in_thread(app: FastAPI, host: str = "127.0.0.1", port: int = 8765) -> uvicorn.Server:
+    """Run the stand-in on a daemon thread (for benchmark scripts); set should_exit to stop it"""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"Fake CoinMarketCap failed to start on {host}:{port}")
+        time.sleep(0.05)
+    return server
+
+
+# ASGI entry point: uvicorn fake_coinmarketcap:app --port 8765
+app = create_app()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    print(f"Fake CoinMarketCap on http://{args.host}:{args.port}/v1 with {asdict(app.state.config)}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
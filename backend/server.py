@@ -1,26 +1,363 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, WebSocket
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError, model_validator
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime
-import requests
+import csv
+import io
+import base64
+import re
+from collections import OrderedDict
+import json
+from datetime import datetime, timedelta, timezone
+import importlib.util
+import abc
+import contextlib
+import functools
+import httpx
+import numpy as np
 import asyncio
-from typing import Union
+import time
+import threading
+import random
+import logging.handlers
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Union, Mapping, Tuple, AsyncIterator, Iterable
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics (Prometheus text format, served on /metrics)
+# Latency buckets in seconds, from in-process cache hits up to upstream timeouts
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS: List["Metric"] = []
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Metric(abc.ABC):
+    """A labelled metric whose samples live in per-thread shards.
+
+    Every thread writes only to its own dict, so recording a sample takes no lock;
+    this matters because Motor reports Mongo commands from its worker threads while
+    handlers record on the event loop. Shards are merged when /metrics is scraped.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        METRICS.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            self._shards.append(values)
+            return values
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines for the current values, one per label set"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merged(self) -> Dict[tuple, float]:
+        merged = {}
+        for shard in list(self._shards):
+            for labels, value in shard.copy().items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in sorted(self._merged().items())]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # Per-bucket (non-cumulative) counts, the last one being +Inf, then the sum
+            entry = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def _merged(self) -> Dict[tuple, list]:
+        merged = {}
+        for shard in list(self._shards):
+            for labels, entry in shard.copy().items():
+                total = merged.setdefault(labels, [0] * len(entry[:-1]) + [0.0])
+                for i, value in enumerate(list(entry)):
+                    total[i] += value
+        return merged
+
+    def samples(self) -> List[str]:
+        lines = []
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, entry in sorted(self._merged().items()):
+            cumulative = 0
+            for le, count in zip(bounds, entry[:-1]):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {entry[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class CallbackMetric(Metric):
+    """Values read from existing counters or state at scrape time"""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Tuple[str, ...], collect):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self._collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in self._collect()]
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"))
+CMC_REQUESTS = Counter(
+    "coinmarketcap_requests_total", "CoinMarketCap calls by endpoint and HTTP status (or exception)", ("endpoint", "status"))
+CMC_REQUEST_DURATION = Histogram(
+    "coinmarketcap_request_duration_seconds", "CoinMarketCap call latency", ("endpoint",))
+PRICE_FALLBACKS = Counter(
+    "price_fallbacks_total", "Requested symbols answered from expired quotes (stale) or left out of the response (missing)",
+    ("reason",))
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency as reported by the driver", ("command",))
+MONGO_COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error", ("command",))
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Driver command timings (called from Motor's worker threads)"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name)
+        MONGO_COMMAND_FAILURES.inc(event.command_name)
+
+# Request Tracing (opt-in; toggled at runtime via /api/admin/tracing)
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'false').lower() == 'true'
+# Fraction of requests traced while enabled, and the duration above which a trace is written out
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '250'))
+TRACE_FILE = Path(os.environ.get('TRACE_FILE', str(ROOT_DIR / 'slow_requests.jsonl')))
+TRACE_FILE_MAX_BYTES = int(os.environ.get('TRACE_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.environ.get('TRACE_FILE_BACKUPS', '5'))
+
+class RequestTrace:
+    """Span timings collected for one sampled request"""
+    __slots__ = ("method", "path", "started", "spans")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+class Span:
+    """Times one awaited stage of the traced request"""
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace: RequestTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter()
+        self.trace.spans.append({
+            "name": self.name,
+            "start_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round((ended - self.started) * 1000, 3),
+            **({"error": exc_type.__name__} if exc_type is not None else {})
+        })
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name: str):
+    """`with span("stage"):` around an awaited stage; free when the request is not traced"""
+    trace = current_trace.get()
+    return _NO_SPAN if trace is None else Span(trace, name)
+
+class RequestTracer:
+    """Samples requests into traces and appends slow ones to a rotating JSON-lines file"""
+
+    def __init__(self, enabled: bool, sample_rate: float, slow_ms: float, path: Path,
+                 max_bytes: int, backups: int):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sampled = 0
+        self.written = 0
+        self._writer: Optional[logging.Logger] = None
+
+    def configure(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None,
+                  slow_ms: Optional[float] = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+
+    def start(self, method: str, path: str) -> Optional[RequestTrace]:
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        self.sampled += 1
+        return RequestTrace(method, path)
+
+    def finish(self, trace: RequestTrace, route: str, status: int):
+        total_ms = (time.perf_counter() - trace.started) * 1000
+        if total_ms < self.slow_ms:
+            return
+        self.written += 1
+        self._get_writer().info(dumps_json({
+            "timestamp": datetime.utcnow(),
+            "method": trace.method,
+            "path": trace.path,
+            "route": route,
+            "status": status,
+            "total_ms": round(total_ms, 3),
+            # Time not covered by any span (handler code, validation, middleware)
+            "untraced_ms": round(total_ms - sum(s["duration_ms"] for s in trace.spans), 3),
+            "spans": trace.spans
+        }).decode())
+
+    def _get_writer(self) -> logging.Logger:
+        if self._writer is None:
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backups, delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            writer = logging.getLogger(f"{__name__}.slow_requests")
+            writer.setLevel(logging.INFO)
+            writer.propagate = False
+            writer.addHandler(handler)
+            self._writer = writer
+        return self._writer
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "file": str(self.path),
+            "sampled": self.sampled,
+            "written": self.written
+        }
+
+request_tracer = RequestTracer(TRACE_ENABLED, TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_FILE,
+                               TRACE_FILE_MAX_BYTES, TRACE_FILE_BACKUPS)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
+# Indexes ensured at startup: (collection, keys, options)
+DB_INDEXES = [
+    ("users", [("id", 1)], {"name": "users_id_unique", "unique": True}),
+    # Signup accepts payloads without an email, so only string emails must be unique
+    ("users", [("email", 1)], {"name": "users_email_unique", "unique": True,
+                               "partialFilterExpression": {"email": {"$type": "string"}}}),
+    # `id` breaks timestamp ties for keyset pagination of the transaction history
+    ("transactions", [("user_id", 1), ("timestamp", -1), ("id", -1)], {"name": "transactions_user_timestamp_id"}),
+    # Ledger sequence numbers; history recorded before the ledger existed has none
+    ("transactions", [("user_id", 1), ("seq", 1)], {"name": "transactions_user_seq_unique", "unique": True,
+                                                    "partialFilterExpression": {"seq": {"$type": "number"}}}),
+    ("price_candles", [("symbol", 1), ("interval", 1), ("start", 1)], {"name": "price_candles_symbol_interval_start",
+                                                                      "unique": True}),
+    # Candles without `expires_at` (the daily tier) are kept
+    ("price_candles", [("expires_at", 1)], {"name": "price_candles_ttl", "expireAfterSeconds": 0}),
+]
+
+# Query shapes the API issues: (handler, collection, equality fields, sort). Maintained by
+# hand next to the handlers, so a new query must be added here to be checked against
+# DB_INDEXES at startup. `$in` on a field counts as equality.
+HOT_QUERIES = [
+    ("get_user", "users", ["id"], []),
+    ("fiat_topup", "users", ["id"], []),
+    ("crypto_swap", "users", ["id"], []),
+    ("bulk_portfolio_valuation", "users", ["id"], []),
+    ("execute_bulk", "users", ["id"], []),
+    ("reconcile_user_ledger", "users", ["id"], []),
+    ("write_import_chunk", "users", ["email"], []),
+    ("get_user_transactions", "transactions", ["user_id"], [("timestamp", -1), ("id", -1)]),
+    ("export_user_transactions", "transactions", ["user_id"], [("timestamp", 1), ("id", 1)]),
+    ("reconcile_ledger", "transactions", ["user_id"], [("seq", 1)]),
+    ("get_statement", "transactions", ["user_id"], [("seq", 1)]),
+    ("get_candles", "price_candles", ["symbol", "interval"], [("start", 1)]),
+    ("PriceHistory.record", "price_candles", ["symbol", "interval", "start"], []),
+]
+
 # Create the main app
 app = FastAPI(title="Akka Fintech API")
 
@@ -29,12 +366,167 @@ api_router = APIRouter(prefix="/api")
 
 # CoinMarketCap API Configuration
 COINMARKETCAP_API_KEY = os.environ.get('COINMARKETCAP_API_KEY')
-COINMARKETCAP_BASE_URL = "https://pro-api.coinmarketcap.com/v1"
+# Point at a local stand-in (see fake_coinmarketcap.py) to test offline without spending credits
+COINMARKETCAP_BASE_URL = os.environ.get('COINMARKETCAP_BASE_URL', "https://pro-api.coinmarketcap.com/v1")
 COINMARKETCAP_HEADERS = {
     "X-CMC_PRO_API_KEY": COINMARKETCAP_API_KEY,
     "Accept": "application/json"
 }
 
+# Shared upstream HTTP client settings (connection pool, keep-alive, timeouts)
+CMC_HTTP_TIMEOUT = float(os.environ.get('CMC_HTTP_TIMEOUT', '5.0'))
+CMC_HTTP_CONNECT_TIMEOUT = float(os.environ.get('CMC_HTTP_CONNECT_TIMEOUT', '2.0'))
+CMC_HTTP_MAX_CONNECTIONS = int(os.environ.get('CMC_HTTP_MAX_CONNECTIONS', '20'))
+CMC_HTTP_MAX_KEEPALIVE = int(os.environ.get('CMC_HTTP_MAX_KEEPALIVE', '10'))
+CMC_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('CMC_HTTP_KEEPALIVE_EXPIRY', '30.0'))
+# HTTP/2 needs the optional `h2` package; fall back to HTTP/1.1 keep-alive without it
+CMC_HTTP2 = os.environ.get('CMC_HTTP2', 'true').lower() == 'true' and importlib.util.find_spec('h2') is not None
+
+# Wall-clock limit for one upstream call (the httpx timeouts above apply per operation)
+CMC_REQUEST_DEADLINE = float(os.environ.get('CMC_REQUEST_DEADLINE', '8.0'))
+# Circuit breaker: consecutive failures before upstream calls fail fast, and how long
+# to wait before probing again (doubled after each failed probe, with jitter)
+CMC_BREAKER_FAILURES = int(os.environ.get('CMC_BREAKER_FAILURES', '5'))
+CMC_BREAKER_BACKOFF = float(os.environ.get('CMC_BREAKER_BACKOFF', '5.0'))
+CMC_BREAKER_MAX_BACKOFF = float(os.environ.get('CMC_BREAKER_MAX_BACKOFF', '120.0'))
+
+# Symbols per upstream quotes call; CoinMarketCap bills one credit per 100 symbols
+CMC_SYMBOLS_PER_REQUEST = int(os.environ.get('CMC_SYMBOLS_PER_REQUEST', '100'))
+CMC_MAX_CONCURRENT_REQUESTS = int(os.environ.get('CMC_MAX_CONCURRENT_REQUESTS', '4'))
+
+# Local snapshot of CoinMarketCap's symbol -> id map, refreshed in the background.
+# The bundled seed is used until the first refresh has been written.
+CMC_ID_MAP_FILE = Path(os.environ.get('CMC_ID_MAP_FILE', str(ROOT_DIR / 'cmc_id_map.json')))
+CMC_ID_MAP_SEED = ROOT_DIR / 'cmc_id_map.seed.json'
+CMC_ID_MAP_REFRESH_INTERVAL = float(os.environ.get('CMC_ID_MAP_REFRESH_INTERVAL', '86400.0'))
+
+# How long a fetched quote is served from the in-process price cache
+PRICE_CACHE_TTL = float(os.environ.get('PRICE_CACHE_TTL', '20.0'))
+# Quotes expired for less than this are served at once while a background refresh runs
+PRICE_STALE_WHILE_REVALIDATE = float(os.environ.get('PRICE_STALE_WHILE_REVALIDATE', '30.0'))
+# Price responses report `stale_age` when a served quote is older than this
+PRICE_STALE_AFTER = float(os.environ.get('PRICE_STALE_AFTER', '45.0'))
+
+# Symbols kept warm by the background price ingestion worker
+DEFAULT_PRICE_SYMBOLS = "BTC,ETH,BNB,ADA,SOL,XRP,DOGE,AVAX,DOT,MATIC"
+TRENDING_SYMBOLS = DEFAULT_PRICE_SYMBOLS + ",LINK,UNI,LTC,BCH,ATOM"
+# Mirrors FEATURED_CRYPTOS in frontend/src/App.js
+FEATURED_CRYPTOS = [
+    'BTC', 'ETH', 'ADA', 'DOT', 'SOL', 'AVAX', 'MATIC', 'ATOM', 'LINK', 'UNI',
+    'AAVE', 'SAND', 'MANA', 'CRV', 'SUSHI', 'YFI', 'BAT', 'ZRX', 'XTZ', 'ALGO',
+    'VET', 'ENJ', 'LRC', 'GRT', 'COMP', 'MKR', 'SNX', 'BAL', 'REN', 'KNC'
+]
+PRICE_INGESTION_ENABLED = os.environ.get('PRICE_INGESTION_ENABLED', 'true').lower() == 'true'
+PRICE_REFRESH_INTERVAL = float(os.environ.get('PRICE_REFRESH_INTERVAL', '15.0'))
+
+# Price history: every ingestion round is stored as raw ticks and rolled into OHLC candles
+PRICE_HISTORY_ENABLED = os.environ.get('PRICE_HISTORY_ENABLED', 'true').lower() == 'true'
+PRICE_TICKS_RETENTION = int(os.environ.get('PRICE_TICKS_RETENTION', str(7 * 86400)))
+# Candle tier -> (bucket seconds, retention seconds; None keeps candles forever)
+CANDLE_TIERS = {"1m": (60, 7 * 86400), "1h": (3600, 400 * 86400), "1d": (86400, None)}
+# Most candles one /crypto/{symbol}/candles response returns (also picks the tier when none is given)
+CANDLE_MAX_POINTS = int(os.environ.get('CANDLE_MAX_POINTS', '1000'))
+
+# Read-through cache of user documents (per process)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '30.0'))
+
+# Most users one bulk portfolio valuation request may ask for
+PORTFOLIO_BULK_MAX = int(os.environ.get('PORTFOLIO_BULK_MAX', '10000'))
+# Currencies every valuation is totalled in
+VALUATION_CURRENCIES = ("USD", "EUR", "TRY")
+# Valuations of more users than this run in a worker thread
+VALUATION_INLINE_MAX = int(os.environ.get('VALUATION_INLINE_MAX', '200'))
+
+# Most operations one /bulk/topups or /bulk/swaps request may carry, and how often users
+# whose documents changed between read and write are re-planned before giving up
+BULK_OPERATIONS_MAX = int(os.environ.get('BULK_OPERATIONS_MAX', '10000'))
+BULK_CONFLICT_RETRIES = int(os.environ.get('BULK_CONFLICT_RETRIES', '3'))
+# Bulk write markers kept per user (ledger.bulk_markers) to tell which users' updates landed
+BULK_MARKERS_KEPT = 16
+
+# NDJSON user import (/users/import): users validated and written per chunk, the longest
+# accepted line, and how many line errors the summary lists
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '1000'))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get('IMPORT_MAX_LINE_BYTES', '65536'))
+IMPORT_ERROR_SAMPLE = int(os.environ.get('IMPORT_ERROR_SAMPLE', '100'))
+
+# Ledger totals and summed transactions closer than this count as reconciled
+LEDGER_TOLERANCE = float(os.environ.get('LEDGER_TOLERANCE', '1e-9'))
+# Most transactions a ledger statement lists
+LEDGER_STATEMENT_MAX = int(os.environ.get('LEDGER_STATEMENT_MAX', '1000'))
+
+# Transaction record writes: "direct" inserts each record before responding, "group"
+# queues it and responds once the batch it was flushed in is acknowledged, and "async"
+# responds as soon as it is queued (queued records are lost if the process dies; ledger
+# reconciliation reports them as sequence gaps)
+TRANSACTION_WRITE_MODE = os.environ.get('TRANSACTION_WRITE_MODE', 'direct')
+# Records per insert_many, and the longest the first queued record waits for a batch to fill
+TRANSACTION_BATCH_SIZE = int(os.environ.get('TRANSACTION_BATCH_SIZE', '500'))
+TRANSACTION_FLUSH_INTERVAL = float(os.environ.get('TRANSACTION_FLUSH_INTERVAL', '0.005'))
+# Records queued but not yet written before handlers wait for room, and how long they wait before a 503
+TRANSACTION_QUEUE_MAX = int(os.environ.get('TRANSACTION_QUEUE_MAX', '20000'))
+TRANSACTION_QUEUE_TIMEOUT = float(os.environ.get('TRANSACTION_QUEUE_TIMEOUT', '1.0'))
+TRANSACTION_FLUSH_RETRIES = int(os.environ.get('TRANSACTION_FLUSH_RETRIES', '5'))
+
+# Rows fetched per cursor batch (and flushed per chunk) by the transaction export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+
+# Fiat reference rates in units per 1 USD (also served by /exchange-rates)
+FIAT_USD_RATES = {"USD": 1.0, "EUR": 0.92, "TRY": 31.5}
+# Rates older than this are flagged as stale in swap quotes
+RATE_MAX_AGE = float(os.environ.get('RATE_MAX_AGE', '120.0'))
+
+# Swap pricing and firm quotes (/api/swap/quote)
+SWAP_FEE = 0.005
+# Currency codes double as portfolio field names, so keep them to plain tickers
+CURRENCY_CODE = re.compile(r"^[A-Z0-9]{1,15}$")
+# Fiat top-up currency -> user balance field
+FIAT_BALANCE_FIELDS = {"EUR": "eur_balance", "TRY": "try_balance"}
+SWAP_QUOTE_TTL = float(os.environ.get('SWAP_QUOTE_TTL', '15.0'))
+SWAP_QUOTE_MAX = int(os.environ.get('SWAP_QUOTE_MAX', '100000'))
+
+# Live price stream (/api/crypto/stream)
+PRICE_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('PRICE_STREAM_MAX_SUBSCRIBERS', '10000'))
+PRICE_STREAM_KEEPALIVE = float(os.environ.get('PRICE_STREAM_KEEPALIVE', '15.0'))
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled async client used for all CoinMarketCap calls"""
+    return httpx.AsyncClient(
+        headers=COINMARKETCAP_HEADERS,
+        http2=CMC_HTTP2,
+        timeout=httpx.Timeout(CMC_HTTP_TIMEOUT, connect=CMC_HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=CMC_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=CMC_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=CMC_HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+# Fast JSON encoding for hot responses
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_json(content) -> bytes:
+    """Encode plain dicts/lists (datetimes included) without jsonable_encoder or Pydantic"""
+    with span("serialize"):
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(content, default=_json_default, separators=(",", ":")).encode()
+
+class FastJSONResponse(Response):
+    """JSON response for hot paths; pre-encoded bytes are sent as-is"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps_json(content)
+
 # Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -59,12 +551,54 @@ class Transaction(BaseModel):
     to_amount: float
     exchange_rate: float
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    seq: Optional[int] = None  # position in the user's ledger; None on records from before the ledger
 
 class SwapRequest(BaseModel):
+    user_id: str
+    quote_id: Optional[str] = None  # execute a firm quote from /swap/quote
+    from_currency: Optional[str] = None
+    to_currency: Optional[str] = None
+    amount: Optional[float] = None
+
+    @model_validator(mode="after")
+    def require_quote_or_pair(self):
+        if self.quote_id is None and None in (self.from_currency, self.to_currency, self.amount):
+            raise ValueError("Either quote_id or from_currency, to_currency and amount are required")
+        return self
+
+class PortfolioValuationRequest(BaseModel):
+    user_ids: List[str] = Field(min_length=1, max_length=PORTFOLIO_BULK_MAX)
+    include_assets: bool = False
+
+class BulkTopupItem(BaseModel):
+    user_id: str
+    currency: str
+    amount: float
+    reference: Optional[str] = None  # caller's own id, echoed in the result
+
+class BulkTopupRequest(BaseModel):
+    items: List[BulkTopupItem] = Field(min_length=1, max_length=BULK_OPERATIONS_MAX)
+
+class BulkSwapItem(BaseModel):
     user_id: str
     from_currency: str
     to_currency: str
     amount: float
+    reference: Optional[str] = None
+
+class BulkSwapRequest(BaseModel):
+    items: List[BulkSwapItem] = Field(min_length=1, max_length=BULK_OPERATIONS_MAX)
+
+class SwapQuoteRequest(BaseModel):
+    user_id: str
+    from_currency: str
+    to_currency: str
+    amount: float
+
+class TracingSettings(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    slow_ms: Optional[float] = Field(default=None, ge=0.0)
 
 class CryptoPrice(BaseModel):
     symbol: str
@@ -74,71 +608,1687 @@ class CryptoPrice(BaseModel):
     market_cap: float
     volume_24h: float
 
+# Circuit Breaker
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with jittered exponential backoff.
+
+    closed:    calls go through; `threshold` failures in a row open the circuit.
+    open:      calls fail fast until the backoff expires.
+    half_open: a single probe call goes through; success closes the circuit, failure
+               re-opens it with a doubled backoff (capped at `max_backoff`).
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, threshold: int, backoff: float, max_backoff: float):
+        self.name = name
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0  # consecutive openings, drives the backoff
+        self.retry_at = 0.0
+        self._probing = False
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected outright"""
+        return self.state == self.OPEN and time.monotonic() < self.retry_at
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() < self.retry_at:
+                self.rejected_total += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self._probing:
+            self.rejected_total += 1
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            delay = min(self.max_backoff, self.backoff * 2 ** self.trips) * random.uniform(0.5, 1.0)
+            self.trips += 1
+            self.opened_total += 1
+            self.state = self.OPEN
+            self.retry_at = time.monotonic() + delay
+            logger.warning(f"{self.name} circuit open for {delay:.1f}s after {self.failures} failures")
+
+    def release(self):
+        """Give up a probe that ended without a verdict (e.g. the caller was cancelled)"""
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in": max(0.0, self.retry_at - time.monotonic()) if self.state == self.OPEN else 0.0,
+            "opened_total": self.opened_total,
+            "rejected_total": self.rejected_total
+        }
+
+cmc_breaker = CircuitBreaker("CoinMarketCap", CMC_BREAKER_FAILURES, CMC_BREAKER_BACKOFF, CMC_BREAKER_MAX_BACKOFF)
+
 # CoinMarketCap Service
 class CoinMarketCapService:
-    @staticmethod
-    async def get_crypto_prices(symbols: str = "BTC,ETH,BNB,ADA,SOL,XRP,DOGE,AVAX,DOT,MATIC"):
+    _http: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def start(cls):
+        """Open the shared connection pool (called at app startup)"""
+        if cls._http is None:
+            cls._http = create_http_client()
+
+    @classmethod
+    async def close(cls):
+        """Close the shared connection pool (called at app shutdown)"""
+        if cls._http is not None:
+            await cls._http.aclose()
+            cls._http = None
+
+    @classmethod
+    async def _get(cls, path: str, params: dict) -> httpx.Response:
+        # Lazily open the pool when the service is used outside the app lifecycle (scripts)
+        cls.start()
+        if not cmc_breaker.allow():
+            CMC_REQUESTS.inc(path, "circuit_open")
+            raise HTTPException(status_code=503, detail="CoinMarketCap unavailable (circuit open)")
+        started = time.perf_counter()
         try:
-            params = {"symbol": symbols, "convert": "USD"}
-            response = requests.get(
-                f"{COINMARKETCAP_BASE_URL}/cryptocurrency/quotes/latest",
-                headers=COINMARKETCAP_HEADERS,
-                params=params
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=429, detail="CoinMarketCap API error")
-                
-            data = response.json()["data"]
-            prices = {}
-            
-            for symbol in symbols.split(","):
-                if symbol in data:
-                    coin_data = data[symbol]
-                    prices[symbol] = {
-                        "symbol": symbol,
-                        "name": coin_data["name"],
-                        "price": coin_data["quote"]["USD"]["price"],
-                        "change_24h": coin_data["quote"]["USD"]["percent_change_24h"],
-                        "market_cap": coin_data["quote"]["USD"]["market_cap"],
-                        "volume_24h": coin_data["quote"]["USD"]["volume_24h"]
-                    }
-            
-            return prices
+            with span(f"coinmarketcap {path}"):
+                response = await asyncio.wait_for(
+                    cls._http.get(f"{COINMARKETCAP_BASE_URL}{path}", params=params), CMC_REQUEST_DEADLINE)
+        except asyncio.CancelledError:
+            cmc_breaker.release()
+            raise
         except Exception as e:
-            print(f"CoinMarketCap API error: {e}")
-            # Return mock data if API fails
-            return {
-                "BTC": {"symbol": "BTC", "name": "Bitcoin", "price": 42000.0, "change_24h": 2.5, "market_cap": 800000000000, "volume_24h": 15000000000},
-                "ETH": {"symbol": "ETH", "name": "Ethereum", "price": 2500.0, "change_24h": 1.8, "market_cap": 300000000000, "volume_24h": 8000000000}
-            }
-    
+            cmc_breaker.record_failure()
+            CMC_REQUESTS.inc(path, type(e).__name__)
+            raise
+        finally:
+            CMC_REQUEST_DURATION.observe(time.perf_counter() - started, path)
+        CMC_REQUESTS.inc(path, str(response.status_code))
+        # Rate limiting and server errors mean upstream is unhealthy; other 4xx are our request
+        if response.status_code == 429 or response.status_code >= 500:
+            cmc_breaker.record_failure()
+        else:
+            cmc_breaker.record_success()
+        return response
+
+    _batch_slots: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    async def fetch_quotes(symbols: List[str]) -> Dict[str, dict]:
+        """Fetch USD quotes from CoinMarketCap in concurrent, credit-sized batches.
+
+        Batches that fail are logged and skipped, so one bad batch only leaves gaps
+        (which callers fill from cache) instead of failing the whole request. An
+        exception is raised only if every batch fails.
+        """
+        if not symbols:
+            return {}
+        if CoinMarketCapService._batch_slots is None:
+            CoinMarketCapService._batch_slots = asyncio.Semaphore(CMC_MAX_CONCURRENT_REQUESTS)
+
+        # Numeric ids are unambiguous; symbols the index does not know are still tried by ticker
+        ids = symbol_index.resolve(symbols)
+        by_id = [s for s in symbols if s in ids]
+        by_symbol = [s for s in symbols if s not in ids]
+        size = CMC_SYMBOLS_PER_REQUEST
+        batches = [(by_id[i:i + size], ids) for i in range(0, len(by_id), size)] + \
+                  [(by_symbol[i:i + size], None) for i in range(0, len(by_symbol), size)]
+        results = await asyncio.gather(
+            *(CoinMarketCapService._fetch_batch(batch, batch_ids) for batch, batch_ids in batches),
+            return_exceptions=True
+        )
+
+        quotes = {}
+        errors = []
+        for (batch, _), result in zip(batches, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"CoinMarketCap batch of {len(batch)} symbols failed: {result!r}")
+                errors.append(result)
+            else:
+                quotes.update(result)
+        if len(errors) == len(batches):
+            raise errors[0]
+        return quotes
+
     @staticmethod
-    async def get_exchange_rate(from_symbol: str, to_symbol: str):
+    async def _fetch_batch(symbols: List[str], ids: Optional[Dict[str, int]]) -> Dict[str, dict]:
+        # skip_invalid keeps one unknown ticker, or an id the map still lists after a
+        # delisting, from failing the whole batch
+        if ids is not None:
+            params = {"id": ",".join(str(ids[s]) for s in symbols), "convert": "USD", "skip_invalid": "true"}
+        else:
+            params = {"symbol": ",".join(symbols), "convert": "USD", "skip_invalid": "true"}
+        async with CoinMarketCapService._batch_slots:
+            response = await CoinMarketCapService._get("/cryptocurrency/quotes/latest", params)
+
+        if response.status_code != 200:
+            raise HTTPException(status_code=429, detail="CoinMarketCap API error")
+
+        data = response.json()["data"]
+        quotes = {}
+
+        for symbol in symbols:
+            key = str(ids[symbol]) if ids is not None else symbol
+            if key in data:
+                coin_data = data[key]
+                quotes[symbol] = {
+                    "symbol": symbol,
+                    "name": coin_data["name"],
+                    "price": coin_data["quote"]["USD"]["price"],
+                    "change_24h": coin_data["quote"]["USD"]["percent_change_24h"],
+                    "market_cap": coin_data["quote"]["USD"]["market_cap"],
+                    "volume_24h": coin_data["quote"]["USD"]["volume_24h"]
+                }
+
+        return quotes
+
+    @staticmethod
+    async def lookup_quotes(symbols: List[str]) -> Dict[str, dict]:
+        """Resolve quotes from the ingestion snapshot; only untracked symbols go upstream (via the cache)"""
+        # Tickers a current id map does not list are dropped without an upstream call
+        symbols = [symbol for symbol in symbols if symbol_index.is_known(symbol)]
+        snapshot = price_worker.snapshot
+        if snapshot is None:
+            return await price_cache.get_quotes(symbols)
+
+        untracked = [symbol for symbol in symbols if symbol not in price_worker.tracked]
+        fetched = await price_cache.get_quotes(untracked) if untracked else {}
+
+        prices = {}
+        for symbol in symbols:
+            if symbol in snapshot.quotes:
+                prices[symbol] = snapshot.quotes[symbol]
+            elif symbol in fetched:
+                prices[symbol] = fetched[symbol]
+        return prices
+
+    @staticmethod
+    def quoted_at(symbols: List[str]) -> Dict[str, datetime]:
+        """When each quote lookup_quotes serves for these symbols was fetched (unquoted symbols are left out)"""
+        snapshot = price_worker.snapshot
+        now = datetime.utcnow()
+        times = {}
+        for symbol in symbols:
+            if snapshot is not None and symbol in snapshot.quotes:
+                times[symbol] = snapshot.quoted_at[symbol]
+            elif price_cache.age(symbol) is not None:
+                times[symbol] = now - timedelta(seconds=price_cache.age(symbol))
+        return times
+
+    @staticmethod
+    def quote_age(symbols: List[str]) -> Optional[float]:
+        """Age in seconds of the oldest quote lookup_quotes serves for these symbols"""
+        times = CoinMarketCapService.quoted_at(symbols)
+        return (datetime.utcnow() - min(times.values())).total_seconds() if times else None
+
+    @staticmethod
+    async def get_crypto_prices(symbols: str = DEFAULT_PRICE_SYMBOLS):
+        # Upstream failures are absorbed by the price cache, which fills gaps from last known quotes
+        return await CoinMarketCapService.lookup_quotes(parse_symbols(symbols))
+
+    @staticmethod
+    async def get_exchange_rate(from_symbol: str, to_symbol: str) -> dict:
+        """Quote a currency pair from the cross-rate matrix, with staleness metadata"""
+        snapshot = price_worker.snapshot
+        rates = snapshot.rates if snapshot is not None else None
+
+        if rates is None or not (rates.supports(from_symbol) and rates.supports(to_symbol)):
+            # No snapshot yet or an untracked symbol: build a one-off matrix for this pair
+            cryptos = [s for s in (from_symbol, to_symbol) if s not in FIAT_USD_RATES]
+            unknown = [s for s in cryptos if not symbol_index.is_known(s)]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unsupported currency: {', '.join(unknown)}")
+            quotes = await CoinMarketCapService.lookup_quotes(cryptos) if cryptos else {}
+            unpriced = [s for s in cryptos if s not in quotes]
+            if unpriced:
+                raise HTTPException(status_code=503, detail=f"No price available for {', '.join(unpriced)}")
+            # Quotes may be last-known-good ones, so keep when each was fetched
+            rates = CrossRates.build(quotes, CoinMarketCapService.quoted_at(cryptos))
+
+        exchange_rate = rates.rate(from_symbol, to_symbol)
+        if exchange_rate is None:
+            raise HTTPException(status_code=400, detail=f"Unsupported currency pair: {from_symbol}/{to_symbol}")
+
+        as_of = rates.as_of((from_symbol, to_symbol))
+        age = (datetime.utcnow() - as_of).total_seconds()
+        return {
+            "rate": exchange_rate,
+            "as_of": as_of.isoformat(),
+            "age_seconds": age,
+            "stale": age > RATE_MAX_AGE
+        }
+
+def stale_age(age: Optional[float]) -> Optional[float]:
+    """`stale_age` field for price responses: set only once quotes are older than PRICE_STALE_AFTER"""
+    return round(age, 1) if age is not None and age > PRICE_STALE_AFTER else None
+
+def parse_symbols(symbols: str) -> List[str]:
+    """Normalize a comma-separated symbol list (upper-case, de-duplicated, order kept)"""
+    return list(dict.fromkeys(s.strip().upper() for s in symbols.split(",") if s.strip()))
+
+async def cancel_task(task: asyncio.Task):
+    """Cancel a background loop and wait for it to finish.
+
+    The cancellation is repeated: asyncio.wait_for (before Python 3.12) drops a
+    cancellation that arrives just as the awaited request completes, and the loop
+    would then go back to sleep until its next refresh.
+    """
+    while not task.done():
+        task.cancel()
+        await asyncio.wait({task}, timeout=1.0)
+
+# Symbol Index
+class SymbolIndex:
+    """Symbol -> CoinMarketCap id map, loaded from a local snapshot file.
+
+    Quotes are requested by id, which is unambiguous for tickers shared by several
+    coins, and unknown symbols can be rejected without an upstream call. The map is
+    refreshed from /cryptocurrency/map in the background and written back to disk.
+
+    Symbols are only rejected while the map is `current` (refreshed within the
+    refresh interval). The bundled seed, or a map whose refresh is failing, can miss
+    newly listed coins, so until then unknown symbols are still tried by ticker.
+    """
+
+    def __init__(self, path: Path, seed_path: Path, refresh_interval: float):
+        self.path = path
+        self.seed_path = seed_path
+        self.refresh_interval = refresh_interval
+        self.ids: Dict[str, int] = {}
+        self.updated_at: Optional[datetime] = None
+        self.current = False
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self):
+        path = self.path if self.path.exists() else self.seed_path
         try:
-            symbols = f"{from_symbol},{to_symbol}"
-            params = {"symbol": symbols, "convert": "USD"}
-            response = requests.get(
-                f"{COINMARKETCAP_BASE_URL}/cryptocurrency/quotes/latest",
-                headers=COINMARKETCAP_HEADERS,
-                params=params
+            snapshot = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"CoinMarketCap id map not loaded from {path}: {e}")
+            return
+        self.ids = {symbol: int(coin_id) for symbol, coin_id in snapshot["ids"].items()}
+        self.updated_at = datetime.fromisoformat(snapshot["updated_at"]) if snapshot.get("updated_at") else None
+        self.current = path == self.path and self.updated_at is not None and \
+            (datetime.utcnow() - self.updated_at).total_seconds() < self.refresh_interval
+
+    def is_known(self, symbol: str) -> bool:
+        # Without a current map nothing can be ruled out, so every symbol is allowed through
+        return not self.current or symbol in self.ids
+
+    def resolve(self, symbols: List[str]) -> Dict[str, int]:
+        return {symbol: self.ids[symbol] for symbol in symbols if symbol in self.ids}
+
+    async def refresh(self):
+        response = await CoinMarketCapService._get(
+            "/cryptocurrency/map", {"listing_status": "active", "sort": "cmc_rank"}
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=429, detail="CoinMarketCap API error")
+
+        # Several coins can share a ticker; the best-ranked one wins
+        best: Dict[str, Tuple[float, int]] = {}
+        for coin in response.json()["data"]:
+            symbol = coin["symbol"].upper()
+            rank = coin.get("rank") or float("inf")
+            if symbol not in best or rank < best[symbol][0]:
+                best[symbol] = (rank, coin["id"])
+
+        self.ids = {symbol: coin_id for symbol, (_, coin_id) in best.items()}
+        self.updated_at = datetime.utcnow()
+        self.current = True
+        await asyncio.to_thread(self._save)
+        logger.info(f"CoinMarketCap id map refreshed: {len(self.ids)} symbols")
+
+    def _save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"updated_at": self.updated_at.isoformat(), "ids": self.ids}, sort_keys=True))
+        os.replace(tmp_path, self.path)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            await cancel_task(self._task)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            age = (datetime.utcnow() - self.updated_at).total_seconds() if self.updated_at else float("inf")
+            delay = self.refresh_interval - age
+            if delay <= 0:
+                try:
+                    await self.refresh()
+                    delay = self.refresh_interval
+                except Exception as e:
+                    logger.warning(f"CoinMarketCap id map refresh failed: {e!r}")
+                    self.current = False
+                    delay = min(self.refresh_interval, 300.0)
+            await asyncio.sleep(delay)
+
+symbol_index = SymbolIndex(CMC_ID_MAP_FILE, CMC_ID_MAP_SEED, CMC_ID_MAP_REFRESH_INTERVAL)
+
+# Price Cache
+class PriceCache:
+    """Per-symbol quote cache with a TTL and single-flight upstream refresh.
+
+    Entries are keyed by symbol rather than by the requested symbol list, so any
+    subset of symbols is served from the same shared cache. Symbols that miss are
+    fetched in one upstream call, and concurrent requests for a symbol that is
+    already being fetched wait on that call instead of issuing their own. Expired
+    entries are kept as last-known-good quotes for when a refresh fails.
+
+    Entries expired for less than `stale_while_revalidate` seconds are returned at
+    once while a background refresh replaces them. While `upstream_down()` is true
+    (the circuit breaker is open) expired entries of any age are served that way,
+    so requests do not queue behind calls that are bound to fail.
+    """
+
+    def __init__(self, ttl: float, fetcher, stale_while_revalidate: float = 0.0, upstream_down=lambda: False):
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._fetcher = fetcher
+        self._upstream_down = upstream_down
+        self._quotes: Dict[str, tuple] = {}  # symbol -> (fetched_at, quote)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.upstream_fetches = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_served = 0
+
+    def age(self, symbol: str) -> Optional[float]:
+        """Seconds since the cached quote for `symbol` was fetched"""
+        entry = self._quotes.get(symbol)
+        return time.monotonic() - entry[0] if entry is not None else None
+
+    async def _refresh(self, symbols: List[str]) -> Dict[str, dict]:
+        self.upstream_fetches += 1
+        try:
+            quotes = await self._fetcher(symbols)
+            fetched_at = time.monotonic()
+            for symbol, quote in quotes.items():
+                self._quotes[symbol] = (fetched_at, quote)
+            return quotes
+        finally:
+            for symbol in symbols:
+                if self._inflight.get(symbol) is asyncio.current_task():
+                    del self._inflight[symbol]
+
+    def _start_refresh(self, symbols: List[str]) -> asyncio.Task:
+        task = asyncio.create_task(self._refresh(symbols))
+        # Keep a failed fetch from being reported as never retrieved when every waiter is gone
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        for symbol in symbols:
+            self._inflight[symbol] = task
+        return task
+
+    async def get_quotes(self, symbols: List[str]) -> Dict[str, dict]:
+        now = time.monotonic()
+        upstream_down = self._upstream_down()
+        cached = {}
+        stale = []
+        waiting: Dict[str, asyncio.Task] = {}
+        misses = []
+
+        for symbol in symbols:
+            entry = self._quotes.get(symbol)
+            age = now - entry[0] if entry is not None else None
+            if age is not None and age < self.ttl:
+                cached[symbol] = entry[1]
+            elif age is not None and (upstream_down or age < self.ttl + self.stale_while_revalidate):
+                cached[symbol] = entry[1]
+                stale.append(symbol)
+            elif symbol in self._inflight:
+                waiting[symbol] = self._inflight[symbol]
+            else:
+                misses.append(symbol)
+        self.hits += len(cached) - len(stale)
+        self.stale_served += len(stale)
+        self.misses += len(misses)
+        self.coalesced += len(waiting)
+
+        revalidate = [symbol for symbol in stale if symbol not in self._inflight]
+        if revalidate and not upstream_down:
+            self._start_refresh(revalidate)
+        if misses:
+            task = self._start_refresh(misses)
+            for symbol in misses:
+                waiting[symbol] = task
+
+        fetched = {}
+        for task in set(waiting.values()):
+            try:
+                # Shield the shared fetch so one cancelled request does not cancel it for the others
+                fetched.update(await asyncio.shield(task))
+            except Exception as e:
+                logger.warning(f"Price refresh failed, serving last known quotes: {e!r}")
+
+        prices = {}
+        for symbol in symbols:
+            if symbol in cached:
+                prices[symbol] = cached[symbol]
+            elif symbol in fetched:
+                prices[symbol] = fetched[symbol]
+            elif symbol in self._quotes:
+                # Expired but last known good: better than a gap in the response
+                prices[symbol] = self._quotes[symbol][1]
+                PRICE_FALLBACKS.inc("stale")
+            else:
+                PRICE_FALLBACKS.inc("missing")
+        return prices
+
+    def __len__(self):
+        return len(self._quotes)
+
+    def put_many(self, quotes: Dict[str, dict]):
+        """Store quotes fetched elsewhere (e.g. by the ingestion worker)"""
+        fetched_at = time.monotonic()
+        for symbol, quote in quotes.items():
+            self._quotes[symbol] = (fetched_at, quote)
+
+price_cache = PriceCache(
+    ttl=PRICE_CACHE_TTL,
+    fetcher=CoinMarketCapService.fetch_quotes,
+    stale_while_revalidate=PRICE_STALE_WHILE_REVALIDATE,
+    upstream_down=cmc_breaker.is_open
+)
+
+# Price Ingestion
+def rank_trending(quotes, limit: int = 10) -> List[dict]:
+    # Sort by market cap descending, handle None values
+    return sorted(quotes, key=lambda x: x.get("market_cap", 0) or 0, reverse=True)[:limit]
+
+class PriceSubscriber:
+    """One stream client: the quotes it has not been sent yet, coalesced per symbol.
+
+    Publishing never blocks on a slow client; if several refreshes happen before
+    the client reads, it only receives the latest quote for each symbol.
+    """
+
+    def __init__(self, symbols: Optional[List[str]] = None):
+        self.symbols = frozenset(symbols) if symbols else None  # None means every symbol
+        self._pending: Dict[str, dict] = {}
+        self._ready = asyncio.Event()
+
+    def offer(self, quotes: Mapping[str, dict]):
+        if self.symbols is None:
+            self._pending.update(quotes)
+        else:
+            for symbol in self.symbols & quotes.keys():
+                self._pending[symbol] = quotes[symbol]
+        if self._pending:
+            self._ready.set()
+
+    async def next(self) -> Dict[str, dict]:
+        await self._ready.wait()
+        self._ready.clear()
+        pending, self._pending = self._pending, {}
+        return pending
+
+class PriceStreamHub:
+    """Fans out changed quotes from each published snapshot to all stream subscribers"""
+
+    def __init__(self, max_subscribers: int):
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+
+    def subscribe(self, symbols: Optional[List[str]] = None) -> PriceSubscriber:
+        if len(self._subscribers) >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="Too many price stream subscribers")
+        subscriber = PriceSubscriber(symbols)
+        # Start every subscriber from the current state; later messages carry only changes
+        if price_worker.snapshot is not None:
+            subscriber.offer(price_worker.snapshot.quotes)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def resubscribe(self, subscriber: PriceSubscriber, symbols: Optional[List[str]]):
+        subscriber.symbols = frozenset(symbols) if symbols else None
+        if price_worker.snapshot is not None:
+            subscriber.offer(price_worker.snapshot.quotes)
+
+    def unsubscribe(self, subscriber: PriceSubscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, previous: Optional["PriceSnapshot"], current: "PriceSnapshot"):
+        if previous is None:
+            delta = current.quotes
+        else:
+            delta = {s: q for s, q in current.quotes.items() if previous.quotes.get(s) != q}
+        if not delta:
+            return
+        for subscriber in self._subscribers:
+            subscriber.offer(delta)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+price_hub = PriceStreamHub(max_subscribers=PRICE_STREAM_MAX_SUBSCRIBERS)
+
+@dataclass(frozen=True)
+class CrossRates:
+    """Dense N x N rate matrix over every priced crypto plus the fiat currencies.
+
+    `matrix[i, j]` is the number of units of currency j per unit of currency i,
+    so quoting any pair is two dict lookups and one array read. Quotes can be of
+    different ages, so a rate is dated by `as_of()` over the symbols it uses.
+    """
+    symbols: Tuple[str, ...]
+    index: Mapping[str, int]
+    matrix: np.ndarray
+    quoted_at: Mapping[str, datetime]  # when each crypto's quote was fetched; fiat rates are fixed
+    built_at: datetime
+
+    @classmethod
+    def build(cls, quotes: Mapping[str, dict], quoted_at: Mapping[str, datetime],
+              built_at: Optional[datetime] = None) -> "CrossRates":
+        cryptos = [s for s in quotes if s not in FIAT_USD_RATES]
+        symbols = tuple(FIAT_USD_RATES) + tuple(cryptos)
+        usd_prices = np.array(
+            [1.0 / FIAT_USD_RATES[s] for s in FIAT_USD_RATES] + [quotes[s]["price"] or np.nan for s in cryptos],
+            dtype=np.float64
+        )
+        usd_prices[usd_prices <= 0] = np.nan
+        matrix = np.divide.outer(usd_prices, usd_prices)
+        matrix.flags.writeable = False
+        return cls(
+            symbols=symbols,
+            index=MappingProxyType({s: i for i, s in enumerate(symbols)}),
+            matrix=matrix,
+            quoted_at=MappingProxyType(dict(quoted_at)),
+            built_at=built_at or datetime.utcnow()
+        )
+
+    def as_of(self, symbols: Iterable[str]) -> datetime:
+        """When the oldest quote behind these symbols was fetched (quotes of unknown age count as built_at)"""
+        return min((self.quoted_at.get(s, self.built_at) for s in symbols if s not in FIAT_USD_RATES),
+                   default=self.built_at)
+
+    def supports(self, symbol: str) -> bool:
+        return symbol in self.index
+
+    def rate(self, from_symbol: str, to_symbol: str) -> Optional[float]:
+        i = self.index.get(from_symbol)
+        j = self.index.get(to_symbol)
+        if i is None or j is None:
+            return None
+        value = self.matrix[i, j]
+        return float(value) if np.isfinite(value) else None
+
+# Distinct /crypto/prices symbol lists whose encoded body is kept per snapshot
+SNAPSHOT_ENCODED_MAX = 128
+
+@dataclass(frozen=True)
+class PriceSnapshot:
+    """Immutable view of the latest ingested prices, replaced wholesale on every refresh"""
+    quotes: Mapping[str, dict]
+    trending: Tuple[dict, ...]
+    rates: CrossRates
+    fetched_at: datetime
+    # When each quote was fetched: symbols missing from a round keep their older quote and time
+    quoted_at: Mapping[str, datetime]
+    # Response bodies already encoded from this snapshot, keyed by what they contain
+    encoded: Dict[tuple, bytes] = field(default_factory=dict, compare=False, repr=False)
+
+    def encode(self, key: tuple, build) -> bytes:
+        body = self.encoded.get(key)
+        if body is None:
+            body = dumps_json(build())
+            if len(self.encoded) < SNAPSHOT_ENCODED_MAX:
+                self.encoded[key] = body
+        return body
+
+class PriceIngestionWorker:
+    """Background task that refreshes all tracked symbols on a fixed cadence.
+
+    Request handlers read `snapshot` instead of calling CoinMarketCap, so their
+    latency no longer depends on the upstream and upstream usage is bounded by
+    the refresh interval rather than by the number of clients.
+    """
+
+    def __init__(self, symbols: List[str], interval: float):
+        self.symbols = symbols
+        self.tracked = frozenset(symbols)
+        self.interval = interval
+        self.snapshot: Optional[PriceSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._history_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self._history_task):
+            if task is not None:
+                await cancel_task(task)
+        self._task = None
+        self._history_task = None
+
+    async def refresh(self):
+        fetched = await CoinMarketCapService.fetch_quotes(self.symbols)
+        now = datetime.utcnow()
+        quotes = fetched
+        quoted_at = {symbol: now for symbol in fetched}
+        if self.snapshot is not None:
+            # Keep the last known quote, and its fetch time, for symbols missing from this round
+            quotes = {**self.snapshot.quotes, **quotes}
+            quoted_at = {**self.snapshot.quoted_at, **quoted_at}
+        self.publish(quotes, quoted_at)
+        price_cache.put_many(fetched)
+        if PRICE_HISTORY_ENABLED:
+            # Written in the background so a slow database cannot hold up the next refresh
+            if self._history_task is not None and not self._history_task.done():
+                logger.warning("Previous price history write still running, skipping this round")
+            else:
+                self._history_task = asyncio.create_task(self._record_history(fetched, self.snapshot.fetched_at))
+
+    async def _record_history(self, fetched: Dict[str, dict], fetched_at: datetime):
+        # Only this round's quotes are history; carried-over ones were recorded already
+        try:
+            await price_history.record(fetched, fetched_at)
+        except Exception as e:
+            logger.warning(f"Price history write failed: {e!r}")
+
+    def publish(self, quotes: Dict[str, dict], quoted_at: Dict[str, datetime]):
+        trending_quotes = [quotes[s] for s in parse_symbols(TRENDING_SYMBOLS) if s in quotes]
+        previous = self.snapshot
+        fetched_at = datetime.utcnow()
+        self.snapshot = PriceSnapshot(
+            quotes=MappingProxyType(dict(quotes)),
+            trending=tuple(rank_trending(trending_quotes)),
+            rates=CrossRates.build(quotes, quoted_at, fetched_at),
+            fetched_at=fetched_at,
+            quoted_at=MappingProxyType(dict(quoted_at))
+        )
+        price_hub.publish(previous, self.snapshot)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Price ingestion failed: {e}")
+            await asyncio.sleep(self.interval)
+
+price_worker = PriceIngestionWorker(
+    symbols=parse_symbols(",".join([DEFAULT_PRICE_SYMBOLS, TRENDING_SYMBOLS] + FEATURED_CRYPTOS)),
+    interval=PRICE_REFRESH_INTERVAL
+)
+
+# Price History
+EPOCH = datetime(1970, 1, 1)
+
+def bucket_start(at: datetime, seconds: int) -> datetime:
+    """Start of the epoch-aligned bucket of `seconds` that contains `at` (naive UTC)"""
+    elapsed = int((at - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=elapsed - elapsed % seconds)
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Stored times are naive UTC, so timezone-aware query values are converted first"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class PriceHistory:
+    """Raw price ticks plus OHLC candles maintained incrementally as ticks arrive.
+
+    Each ingestion round appends one tick per symbol to the `price_ticks` time-series
+    collection and applies one upsert per (symbol, tier) to `price_candles`: the first
+    tick of a bucket sets `open`, later ones raise `high`, lower `low` and move `close`.
+    Charts then read a single tier with one indexed range scan instead of replaying ticks.
+    """
+
+    def __init__(self, tiers: Dict[str, Tuple[int, Optional[int]]], ticks_retention: int):
+        self.tiers = tiers
+        self.ticks_retention = ticks_retention
+
+    async def ensure_collections(self):
+        """Create `price_ticks` as a time-series collection (MongoDB 5.0+) if it does not exist"""
+        try:
+            if "price_ticks" in await db.list_collection_names():
+                return
+            await db.create_collection(
+                "price_ticks",
+                timeseries={"timeField": "timestamp", "metaField": "symbol", "granularity": "seconds"},
+                expireAfterSeconds=self.ticks_retention
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=429, detail="CoinMarketCap API error")
-                
-            data = response.json()["data"]
-            
-            if from_symbol in data and to_symbol in data:
-                from_price = data[from_symbol]["quote"]["USD"]["price"]
-                to_price = data[to_symbol]["quote"]["USD"]["price"]
-                exchange_rate = from_price / to_price
-                return exchange_rate
-            
-            return 1.0
+            logger.info("Time-series collection ready: price_ticks")
         except Exception as e:
-            print(f"Exchange rate error: {e}")
-            return 1.0
+            # Older servers: a plain collection with a TTL index keeps the same retention
+            logger.warning(f"price_ticks created as a plain collection ({e!r})")
+            await db.price_ticks.create_index([("timestamp", 1)], name="price_ticks_ttl",
+                                              expireAfterSeconds=self.ticks_retention)
+
+    def candle_updates(self, quotes: Dict[str, dict], at: datetime) -> List[UpdateOne]:
+        updates = []
+        for symbol, quote in quotes.items():
+            price = quote["price"]
+            for interval, (seconds, retention) in self.tiers.items():
+                start = bucket_start(at, seconds)
+                on_insert = {"open": price}
+                if retention is not None:
+                    on_insert["expires_at"] = start + timedelta(seconds=seconds + retention)
+                updates.append(UpdateOne(
+                    {"symbol": symbol, "interval": interval, "start": start},
+                    {"$setOnInsert": on_insert, "$max": {"high": price}, "$min": {"low": price},
+                     "$set": {"close": price, "updated_at": at}},
+                    upsert=True
+                ))
+        return updates
+
+    async def record(self, quotes: Dict[str, dict], at: datetime):
+        if not quotes:
+            return
+        ticks = [{"timestamp": at, "symbol": symbol, "price": quote["price"],
+                  "volume_24h": quote["volume_24h"], "market_cap": quote["market_cap"]}
+                 for symbol, quote in quotes.items()]
+        await db.price_ticks.insert_many(ticks, ordered=False)
+        await db.price_candles.bulk_write(self.candle_updates(quotes, at), ordered=False)
+
+    def pick_interval(self, start: datetime, end: datetime) -> str:
+        """Finest tier that covers the range in at most CANDLE_MAX_POINTS candles"""
+        span_seconds = (end - start).total_seconds()
+        for interval, (seconds, _) in sorted(self.tiers.items(), key=lambda item: item[1][0]):
+            if span_seconds / seconds <= CANDLE_MAX_POINTS:
+                return interval
+        return max(self.tiers, key=lambda interval: self.tiers[interval][0])
+
+    async def candles(self, symbol: str, interval: str, start: datetime, end: datetime, limit: int) -> List[dict]:
+        return await db.price_candles.find(
+            {"symbol": symbol, "interval": interval, "start": {"$gte": bucket_start(start, self.tiers[interval][0]),
+                                                                "$lt": end}},
+            {"_id": 0, "start": 1, "open": 1, "high": 1, "low": 1, "close": 1}
+        ).sort("start", 1).limit(limit).to_list(limit)
+
+price_history = PriceHistory(CANDLE_TIERS, PRICE_TICKS_RETENTION)
+
+# Swap Quotes
+class SwapQuoteStore:
+    """In-memory firm swap quotes with TTL eviction.
+
+    Every quote lives for the same TTL, so insertion order is also expiry order
+    and expired quotes are evicted from the front of the OrderedDict.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._quotes: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    def _evict(self, now: float):
+        while self._quotes:
+            expires, _ = next(iter(self._quotes.values()))
+            if expires > now and len(self._quotes) <= self.max_size:
+                break
+            self._quotes.popitem(last=False)
+
+    def issue(self, quote: dict) -> dict:
+        now = time.monotonic()
+        quote = {
+            **quote,
+            "quote_id": str(uuid.uuid4()),
+            "expires_at": (datetime.utcnow() + timedelta(seconds=self.ttl)).isoformat()
+        }
+        self._quotes[quote["quote_id"]] = (now + self.ttl, quote)
+        self._evict(now)
+        return quote
+
+    def peek(self, quote_id: str) -> Optional[dict]:
+        """Return a live quote without using it up"""
+        self._evict(time.monotonic())
+        entry = self._quotes.get(quote_id)
+        return entry[1] if entry is not None else None
+
+    def take(self, quote_id: str) -> Optional[dict]:
+        """Remove and return a live quote; quotes can be executed only once"""
+        self._evict(time.monotonic())
+        entry = self._quotes.pop(quote_id, None)
+        return entry[1] if entry is not None else None
+
+    def restore(self, quote: dict):
+        """Put back a taken quote whose swap moved no funds; it keeps its original expiry"""
+        remaining = (datetime.fromisoformat(quote["expires_at"]) - datetime.utcnow()).total_seconds()
+        if remaining > 0:
+            now = time.monotonic()
+            self._quotes[quote["quote_id"]] = (now + remaining, quote)
+            self._evict(now)
+
+    def __len__(self):
+        return len(self._quotes)
+
+swap_quotes = SwapQuoteStore(ttl=SWAP_QUOTE_TTL, max_size=SWAP_QUOTE_MAX)
+
+def swap_request_error(from_currency: str, to_currency: str, amount: float) -> Optional[str]:
+    if not (CURRENCY_CODE.match(from_currency) and CURRENCY_CODE.match(to_currency)):
+        return "Invalid currency"
+    if from_currency == to_currency:
+        return "Cannot swap a currency to itself"
+    if amount <= 0:
+        return "Amount must be positive"
+    return None
+
+async def price_swap(from_currency: str, to_currency: str, amount: float) -> dict:
+    """Price a swap from the cross-rate matrix (with the 0.5% fee applied)"""
+    error = swap_request_error(from_currency, to_currency, amount)
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+
+    with span("exchange_rate"):
+        rate = await CoinMarketCapService.get_exchange_rate(from_currency, to_currency)
+    return {
+        "from_currency": from_currency,
+        "to_currency": to_currency,
+        "amount": amount,
+        "exchange_rate": rate["rate"],
+        "receive_amount": (amount * rate["rate"]) * (1 - SWAP_FEE),
+        "fee_percentage": SWAP_FEE * 100,
+        "rate_as_of": rate["as_of"],
+        "rate_age_seconds": rate["age_seconds"],
+        "rate_stale": rate["stale"]
+    }
+
+# User Cache
+def ledger_seq(user_data: dict) -> int:
+    """Number of ledger transactions applied to a user document (every balance write advances it)"""
+    return (user_data.get("ledger") or {}).get("seq", 0)
+
+class UserCache:
+    """Bounded LRU cache of user documents keyed by user id, with a TTL.
+
+    Write paths replace the cached document with the one their update returned
+    (or invalidate it), so a balance is never served stale after a write in this
+    process. Concurrent writes can return in any order, so a returned document
+    only replaces a cached one with at least the same ledger.seq. Read-path fills
+    are dropped if a write to the same user happened while the read was in flight,
+    so a slow read cannot overwrite a newer document.
+
+    Write epochs are kept for the most recently written max_size users. Users
+    dropped from that list read as written at the newest dropped epoch, so a read
+    in flight across the drop is discarded rather than trusted.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._write_epochs: "OrderedDict[str, int]" = OrderedDict()
+        self._last_epoch = 0
+        self._dropped_epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[dict]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def read_epoch(self, user_id: str) -> int:
+        """Token to pass to fill() for this user's document read from the database"""
+        return self._write_epochs.get(user_id, self._dropped_epoch)
+
+    def fill(self, user_id: str, user_data: dict, epoch: int):
+        if epoch == self.read_epoch(user_id):
+            self._store(user_id, user_data)
+
+    def put(self, user_id: str, user_data: dict):
+        """Store the document returned by a balance write, unless a newer one is cached"""
+        self._written(user_id)
+        entry = self._entries.get(user_id)
+        if entry is not None and ledger_seq(entry[1]) > ledger_seq(user_data):
+            return
+        self._store(user_id, user_data)
+
+    def invalidate(self, user_id: str):
+        self._written(user_id)
+        if self._entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def _written(self, user_id: str):
+        self._last_epoch += 1
+        self._write_epochs[user_id] = self._last_epoch
+        self._write_epochs.move_to_end(user_id)
+        while len(self._write_epochs) > self.max_size:
+            _, self._dropped_epoch = self._write_epochs.popitem(last=False)
+
+    def _store(self, user_id: str, user_data: dict):
+        self._entries[user_id] = (time.monotonic() + self.ttl, user_data)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+user_cache = UserCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+async def load_user(user_id: str) -> Optional[dict]:
+    """Read a user document through the user cache"""
+    user_data = user_cache.get(user_id)
+    if user_data is None:
+        epoch = user_cache.read_epoch(user_id)
+        with span("mongo users.find_one"):
+            user_data = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if user_data is not None:
+            user_cache.fill(user_id, user_data, epoch)
+    return user_data
+
+# Portfolio Valuation
+def holding_amount(value) -> Optional[float]:
+    """Portfolio entries are plain amounts, or {"amount": ..., "value": ...} in older documents"""
+    if isinstance(value, dict):
+        value = value.get("amount")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+async def valuation_rates(symbols: List[str]) -> Tuple[CrossRates, Mapping[str, dict]]:
+    """The snapshot's rates and quotes, rebuilt with quotes for held symbols it does not track"""
+    snapshot = price_worker.snapshot
+    if snapshot is not None and all(snapshot.rates.supports(s) for s in symbols):
+        return snapshot.rates, snapshot.quotes
+    quotes = dict(snapshot.quotes) if snapshot is not None else {}
+    missing = [s for s in symbols if s not in FIAT_USD_RATES and s not in quotes]
+    if missing:
+        quotes.update(await CoinMarketCapService.lookup_quotes(missing))
+    quoted_at = CoinMarketCapService.quoted_at([s for s in quotes if s not in FIAT_USD_RATES])
+    return CrossRates.build(quotes, quoted_at), quotes
+
+def holding_field(currency: str) -> str:
+    """User document field holding a currency: the fiat balance fields, else crypto_portfolio"""
+    return FIAT_BALANCE_FIELDS.get(currency, f"crypto_portfolio.{currency}")
+
+def user_holdings(user: dict) -> Dict[str, float]:
+    """Non-zero fiat balances and crypto amounts of a user document, keyed by currency"""
+    row = {currency: holding_amount(user.get(field)) or 0.0 for currency, field in FIAT_BALANCE_FIELDS.items()}
+    # A fiat currency can also sit in crypto_portfolio: both count towards the holding
+    for symbol, value in (user.get("crypto_portfolio") or {}).items():
+        symbol = symbol.upper()
+        row[symbol] = row.get(symbol, 0.0) + (holding_amount(value) or 0.0)
+    return {symbol: amount for symbol, amount in row.items() if amount}
+
+async def value_portfolios(users: List[dict], include_assets: bool) -> List[dict]:
+    """Value users' fiat balances and crypto holdings in VALUATION_CURRENCIES.
+
+    Holdings are laid out as a users x assets amount matrix, so prices, 24h changes
+    and FX conversion are applied to every user in a few array operations.
+    """
+    holdings = [user_holdings(user) for user in users]
+    assets = sorted({symbol for row in holdings for symbol in row})
+    rates, quotes = await valuation_rates(assets)
+    compute = functools.partial(valuation_results, users, holdings, assets, rates, quotes, include_assets)
+    if len(users) > VALUATION_INLINE_MAX:
+        # Batch jobs are valued off the event loop so other requests keep being served
+        return await asyncio.to_thread(compute)
+    return compute()
+
+def valuation_results(users: List[dict], holdings: List[Dict[str, float]], assets: List[str], rates: CrossRates,
+                      quotes: Mapping[str, dict], include_assets: bool) -> List[dict]:
+    column = {symbol: j for j, symbol in enumerate(assets)}
+    amounts = np.zeros((len(users), len(assets)))
+    for i, row in enumerate(holdings):
+        for symbol, amount in row.items():
+            amounts[i, column[symbol]] = amount
+
+    usd = rates.index["USD"]
+    prices = np.array([rates.matrix[rates.index[s], usd] if rates.supports(s) else np.nan for s in assets])
+    changes = np.array([(quotes.get(s) or {}).get("change_24h") or 0.0 for s in assets])
+    fx = rates.matrix[usd, [rates.index[c] for c in VALUATION_CURRENCIES]]
+
+    priced = np.isfinite(prices)
+    prices = np.where(priced, prices, 0.0)
+    values = amounts * prices
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # A -100% change has no finite previous price: count the asset as flat
+        previous_prices = np.where(changes > -100.0, prices / (1.0 + changes / 100.0), prices)
+    previous = amounts * previous_prices
+    totals = values.sum(axis=1)
+    previous_totals = previous.sum(axis=1)
+    pnl = totals - previous_totals
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(totals[:, None] > 0, values / totals[:, None], 0.0)
+        pnl_percent = np.where(previous_totals > 0, pnl / previous_totals * 100, 0.0)
+    totals_fx = totals[:, None] * fx
+    pnl_fx = pnl[:, None] * fx
+
+    now = datetime.utcnow()
+    results = []
+    for i, user in enumerate(users):
+        held = [j for j in range(len(assets)) if amounts[i, j]]
+        # Dated by the oldest quote this user's holdings are valued with
+        as_of = rates.as_of(assets[j] for j in held)
+        result = {
+            "user_id": user["id"],
+            "totals": dict(zip(VALUATION_CURRENCIES, totals_fx[i].tolist())),
+            "pnl_24h": {**dict(zip(VALUATION_CURRENCIES, pnl_fx[i].tolist())), "percent": float(pnl_percent[i])},
+            "unpriced": [assets[j] for j in held if not priced[j]],
+            "as_of": as_of.isoformat(),
+            "stale": (now - as_of).total_seconds() > RATE_MAX_AGE
+        }
+        if include_assets:
+            result["assets"] = sorted((
+                {
+                    "symbol": assets[j],
+                    "amount": float(amounts[i, j]),
+                    "price_usd": float(prices[j]) if priced[j] else None,
+                    "value": dict(zip(VALUATION_CURRENCIES, (values[i, j] * fx).tolist())),
+                    "weight": float(weights[i, j]),
+                    "change_24h": float(changes[j]),
+                    "pnl_24h_usd": float(values[i, j] - previous[i, j])
+                }
+                for j in held
+            ), key=lambda asset: -asset["value"]["USD"])
+        results.append(result)
+    return results
+
+# Ledger
+# Each user document carries a running summary of its transactions:
+#   ledger.seq          number of ledger transactions applied
+#   ledger.totals.<CUR> net amount moved per currency
+#   ledger.last_txn_id  id of the transaction with sequence number `seq`
+#   ledger.checkpoint   {seq, totals, at} of the last successful reconciliation
+# The summary is advanced in the same update that moves the funds, and the transaction
+# is stored with the sequence number that update returned. Reconciliation and
+# statements then only read the transactions after the checkpoint.
+def ledger_update(update: dict, transaction_id: str, deltas: Dict[str, float], count: int = 1) -> dict:
+    """Add the ledger bookkeeping for `count` transactions (the last being transaction_id) to a user update"""
+    inc = dict(update.get("$inc", {}))
+    inc["ledger.seq"] = count
+    for currency, delta in deltas.items():
+        inc[f"ledger.totals.{currency}"] = inc.get(f"ledger.totals.{currency}", 0.0) + delta
+    return {**update, "$inc": inc, "$set": {**update.get("$set", {}), "ledger.last_txn_id": transaction_id}}
+
+def transaction_deltas(transaction: dict) -> Dict[str, float]:
+    """Net amount a recorded transaction moved per currency (the inverse of the ledger update)"""
+    deltas = {transaction["to_currency"]: transaction["to_amount"]}
+    if transaction["transaction_type"] != "fiat_topup":
+        deltas[transaction["from_currency"]] = deltas.get(transaction["from_currency"], 0.0) \
+            - transaction["from_amount"]
+    return deltas
+
+def ledger_summary(user_data: dict) -> dict:
+    ledger = user_data.get("ledger") or {}
+    checkpoint = ledger.get("checkpoint") or {"seq": 0, "totals": {}, "at": None}
+    return {"seq": ledger.get("seq", 0), "totals": ledger.get("totals", {}),
+            "last_txn_id": ledger.get("last_txn_id"), "checkpoint": checkpoint}
+
+def ledger_entries(user_id: str, after_seq: int, upto_seq: int):
+    """Cursor over the user's ledger transactions with after_seq < seq <= upto_seq, in order"""
+    return db.transactions.find(
+        {"user_id": user_id, "seq": {"$gt": after_seq, "$lte": upto_seq}}, {"_id": 0}
+    ).sort("seq", 1).batch_size(EXPORT_BATCH_SIZE)
+
+def totals_match(expected: Dict[str, float], actual: Dict[str, float]) -> bool:
+    return all(abs(expected.get(currency, 0.0) - actual.get(currency, 0.0)) <= LEDGER_TOLERANCE
+               for currency in set(expected) | set(actual))
+
+async def reconcile_ledger(user_data: dict) -> dict:
+    """Check ledger.totals against the transactions recorded since the last checkpoint.
+
+    On a match the checkpoint moves up to the current sequence number. A gap in the
+    sequence means a transaction was not recorded (or is still being written).
+    """
+    user_id = user_data["id"]
+    summary = ledger_summary(user_data)
+    checkpoint = summary["checkpoint"]
+    totals = dict(checkpoint["totals"])
+    expected_seq = checkpoint["seq"] + 1
+    missing = []
+    applied = 0
+    with span("mongo transactions.find"):
+        async for transaction in ledger_entries(user_id, checkpoint["seq"], summary["seq"]):
+            missing.extend(range(expected_seq, transaction["seq"]))
+            expected_seq = transaction["seq"] + 1
+            for currency, delta in transaction_deltas(transaction).items():
+                totals[currency] = totals.get(currency, 0.0) + delta
+            applied += 1
+    missing.extend(range(expected_seq, summary["seq"] + 1))
+
+    reconciled = not missing and totals_match(totals, summary["totals"])
+    result = {"user_id": user_id, "reconciled": reconciled, "seq": summary["seq"],
+              "from_seq": checkpoint["seq"], "transactions_checked": applied,
+              "missing_seqs": missing, "ledger_totals": summary["totals"], "computed_totals": totals}
+    if reconciled and summary["seq"] > checkpoint["seq"]:
+        new_checkpoint = {"seq": summary["seq"], "totals": totals, "at": datetime.utcnow()}
+        # Only advance from the checkpoint this run started at (a concurrent run may have moved it);
+        # None also matches a user that has no checkpoint yet
+        started_at = checkpoint["seq"] if checkpoint["at"] is not None else None
+        with span("mongo users.update_one"):
+            await db.users.update_one(
+                {"id": user_id, "ledger.checkpoint.seq": started_at},
+                {"$set": {"ledger.checkpoint": new_checkpoint}}
+            )
+        # The checkpoint write leaves ledger.seq alone, so a concurrent balance write's
+        # document could not be told apart from this one: drop the entry instead
+        user_cache.invalidate(user_id)
+        result["checkpoint"] = new_checkpoint
+    else:
+        result["checkpoint"] = checkpoint
+    return result
+
+# Transaction Writer
+class TransactionWriter:
+    """Write-behind batching of transaction inserts.
+
+    Handlers take a queue slot before moving any funds, so a full queue becomes a 503
+    instead of a balance change whose record cannot be written. A record that still
+    fails to be written is reported back as such, never as an error: the funds have
+    already moved, and a client that retried would move them twice. One flush task drains
+    the queue with insert_many(ordered=False) as soon as `batch_size` records are
+    waiting, or `flush_interval` after the first one arrived. Retried batches are
+    idempotent: records keep the _id assigned on the first attempt, and duplicates
+    are ignored.
+    """
+    MODES = ("direct", "group", "async")
+
+    def __init__(self, mode: str, batch_size: int, flush_interval: float, queue_max: int, queue_timeout: float):
+        if mode not in self.MODES:
+            raise ValueError(f"TRANSACTION_WRITE_MODE must be one of {', '.join(self.MODES)}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batches = 0
+
+    def start(self):
+        # Queue primitives are created here so they belong to the serving event loop
+        if self._task is None:
+            self._queue: "asyncio.Queue[Optional[Tuple[dict, Optional[asyncio.Future]]]]" = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.queue_max)
+            self._batch_ready = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything queued, then stop; later writes go straight to the database"""
+        if self._task is not None:
+            self._stopping = True
+            self._queue.put_nowait(None)
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._task is not None else 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Reserve room for one record; yields the coroutine function that writes it.
+
+        The write returns False if the record is known not to have been written; in
+        async mode it returns once the record is queued. A slot that is never written
+        (the handler failed first) is given back on exit.
+        """
+        mode = self.mode
+        if mode == "direct" or self._task is None or self._stopping:
+            yield self._insert_one
+            return
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Transaction queue is full, retry later",
+                                headers={"Retry-After": "1"})
+        taken = False
+
+        async def write(record: dict) -> bool:
+            nonlocal taken
+            taken = True
+            if self._stopping:
+                # The flush task may already have exited
+                self._slots.release()
+                return await self._insert_one(record)
+            future = asyncio.get_running_loop().create_future() if mode == "group" else None
+            self._queue.put_nowait((record, future))
+            if self._queue.qsize() >= self.batch_size - 1:
+                self._batch_ready.set()
+            if future is None:
+                return True
+            with span("transactions.group_commit"):
+                # Shielded: a disconnecting client must not cancel the shared batch
+                return await asyncio.shield(future)
+
+        try:
+            yield write
+        finally:
+            if not taken:
+                self._slots.release()
+
+    async def _insert_one(self, record: dict) -> bool:
+        try:
+            with span("mongo transactions.insert_one"):
+                await db.transactions.insert_one(record)
+        except PyMongoError as e:
+            self.failed += 1
+            logger.error(f"Dropped transaction record {record['id']} ({e!r})")
+            return False
+        return True
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if self._queue.qsize() < self.batch_size - 1 and not self._stopping:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [item]
+            stopping = False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Tuple[dict, Optional[asyncio.Future]]]):
+        records = [record for record, _ in batch]
+        error: Optional[Exception] = None
+        for attempt in range(TRANSACTION_FLUSH_RETRIES):
+            try:
+                await db.transactions.insert_many(records, ordered=False)
+                error = None
+                break
+            except BulkWriteError as e:
+                # Duplicate keys are records an earlier attempt already wrote
+                if not e.details.get("writeConcernErrors") and \
+                        all(err.get("code") == 11000 for err in e.details.get("writeErrors", [])):
+                    error = None
+                    break
+                error = e
+            except PyMongoError as e:
+                error = e
+            await asyncio.sleep(min(1.0, 0.05 * 2 ** attempt))
+
+        self.batches += 1
+        if error is None:
+            self.written += len(records)
+        else:
+            self.failed += len(records)
+            logger.error(f"Dropped {len(records)} transaction records after {TRANSACTION_FLUSH_RETRIES} "
+                         f"attempts ({error!r}): {[record['id'] for record in records]}")
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(error is None)
+        for _ in batch:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self.depth(),
+            "queue_max": self.queue_max,
+            "written": self.written,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "mean_batch": (self.written + self.failed) / self.batches if self.batches else 0.0
+        }
+
+transaction_writer = TransactionWriter(TRANSACTION_WRITE_MODE, TRANSACTION_BATCH_SIZE, TRANSACTION_FLUSH_INTERVAL,
+                                       TRANSACTION_QUEUE_MAX, TRANSACTION_QUEUE_TIMEOUT)
+
+# Bulk Operations
+@dataclass
+class BulkOperation:
+    """One item of a bulk request, planned against its user's document"""
+    index: int
+    result: dict
+    transaction: Optional[Transaction] = None
+    changes: Dict[str, float] = field(default_factory=dict)  # user document field -> delta
+    debit: Optional[Tuple[str, float]] = None  # field that must cover the amount, and the amount
+    balance_field: Optional[str] = None  # field reported back as new_balance
+
+def plan_user_operations(user: dict, operations: List[BulkOperation],
+                         marker: str) -> Tuple[Optional[UpdateOne], List[BulkOperation]]:
+    """Apply a user's operations in order to a copy of their balances.
+
+    Returns one conditional update for all operations that can be applied and those
+    operations. The filter pins ledger.seq and every debited balance to the values
+    read, so the update only lands if the document has not changed since. The update
+    also pushes `marker`, which no other writer sets, to show that it landed.
+    """
+    def current(path: str):
+        value = user
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    seq = current("ledger.seq") or 0
+    balances: Dict[str, float] = {}
+    guards: Dict[str, Any] = {}
+    inc: Dict[str, float] = {}
+    deltas: Dict[str, float] = {}
+    applied = []
+    for operation in operations:
+        if operation.debit is not None:
+            debit_field, amount = operation.debit
+            if debit_field not in balances:
+                guards[debit_field] = current(debit_field)
+            available = balances.get(debit_field, holding_amount(current(debit_field)) or 0.0)
+            if available < amount:
+                operation.result.update(status="rejected", error="Insufficient balance")
+                # A re-plan can reject an item an earlier plan had applied
+                operation.result.pop("transaction_id", None)
+                operation.result.pop("new_balance", None)
+                continue
+        for change_field, delta in operation.changes.items():
+            balances[change_field] = balances.get(change_field, holding_amount(current(change_field)) or 0.0) + delta
+            inc[change_field] = inc.get(change_field, 0.0) + delta
+        if operation.balance_field is not None:
+            operation.result["new_balance"] = balances[operation.balance_field]
+        seq += 1
+        operation.transaction.seq = seq
+        for currency, delta in transaction_deltas(operation.transaction.dict()).items():
+            deltas[currency] = deltas.get(currency, 0.0) + delta
+        applied.append(operation)
+
+    if not applied:
+        return None, []
+    # ledger.seq only exists once a transaction was applied; None also matches a missing field
+    query = {"id": user["id"], "ledger.seq": current("ledger.seq"), **guards}
+    update = ledger_update({"$inc": inc}, applied[-1].transaction.id, deltas, count=len(applied))
+    update["$push"] = {"ledger.bulk_markers": {"$each": [marker], "$slice": -BULK_MARKERS_KEPT}}
+    for operation in applied:
+        operation.result.update(status="applied", transaction_id=operation.transaction.id)
+    return UpdateOne(query, update), applied
+
+async def execute_bulk(operations: List[BulkOperation]) -> List[dict]:
+    """Apply planned operations with one bulk_write per attempt, then record their transactions.
+
+    Users whose document changed between the read and the write are re-read and
+    re-planned up to BULK_CONFLICT_RETRIES times; their remaining items then
+    report `conflict` and can be resubmitted.
+    """
+    pending: Dict[str, List[BulkOperation]] = {}
+    for operation in operations:
+        if operation.transaction is not None:
+            pending.setdefault(operation.transaction.user_id, []).append(operation)
+
+    recorded: List[dict] = []
+    for attempt in range(BULK_CONFLICT_RETRIES + 1):
+        if not pending:
+            break
+        with span("mongo users.find"):
+            users = await db.users.find(
+                {"id": {"$in": list(pending)}},
+                {"_id": 0, "id": 1, "ledger.seq": 1, "crypto_portfolio": 1,
+                 **{balance_field: 1 for balance_field in FIAT_BALANCE_FIELDS.values()}}
+            ).to_list(len(pending))
+        found = {user["id"]: user for user in users}
+        for user_id in [user_id for user_id in pending if user_id not in found]:
+            for operation in pending.pop(user_id):
+                operation.result.update(status="not_found", error="User not found")
+
+        requests = []
+        planned: Dict[str, List[BulkOperation]] = {}
+        marker = uuid.uuid4().hex
+        for user_id, user_operations in pending.items():
+            for operation in user_operations:
+                operation.result.pop("error", None)
+            request, applied = plan_user_operations(found[user_id], user_operations, marker)
+            if request is not None:
+                requests.append(request)
+                planned[user_id] = applied
+        # Users whose items were all rejected are done
+        pending = {user_id: pending[user_id] for user_id in planned}
+        if not requests:
+            break
+
+        failed = set()
+        with span("mongo users.bulk_write"):
+            try:
+                matched = (await db.users.bulk_write(requests, ordered=False)).matched_count
+            except BulkWriteError as e:
+                # e.g. a holding stored in a shape $inc cannot update; the other users' writes went through
+                user_ids = list(planned)
+                failed = {user_ids[error["index"]] for error in e.details.get("writeErrors", [])}
+                matched = e.details.get("nMatched", 0)
+        for user_id in failed:
+            for operation in planned.pop(user_id):
+                operation.result.update(status="failed", error="Balance could not be updated")
+                operation.result.pop("transaction_id", None)
+                operation.result.pop("new_balance", None)
+            pending.pop(user_id)
+        conflicted = set()
+        if matched < len(planned):
+            # Find out which users' updates did not match: this attempt's marker is missing.
+            # Not ledger.last_txn_id, which a write landing since would have replaced
+            with span("mongo users.find"):
+                landed = {user["id"] async for user in db.users.find(
+                    {"id": {"$in": list(planned)}, "ledger.bulk_markers": marker}, {"_id": 0, "id": 1})}
+            conflicted = set(planned) - landed
+
+        for user_id in planned:
+            user_cache.invalidate(user_id)
+            if user_id not in conflicted:
+                recorded.extend(operation.transaction.dict() for operation in planned[user_id])
+        pending = {user_id: pending[user_id] for user_id in conflicted}
+
+    for user_operations in pending.values():
+        for operation in user_operations:
+            operation.result.update(status="conflict", error="Balance changed concurrently, retry the item")
+            operation.result.pop("transaction_id", None)
+            operation.result.pop("new_balance", None)
+    lost = set()
+    if recorded:
+        try:
+            with span("mongo transactions.insert_many"):
+                await db.transactions.insert_many(recorded, ordered=False)
+        except BulkWriteError as e:
+            lost = {recorded[error["index"]]["id"] for error in e.details.get("writeErrors", [])}
+        except PyMongoError:
+            lost = {record["id"] for record in recorded}
+        if lost:
+            # The balances have moved either way, so the items still report applied
+            logger.error(f"Dropped {len(lost)} bulk transaction records: {sorted(lost)}")
+    for operation in operations:
+        if operation.result.get("status") == "applied":
+            operation.result["transaction_recorded"] = operation.transaction.id not in lost
+    return [operation.result for operation in operations]
+
+def bulk_summary(results: List[dict]) -> Dict[str, int]:
+    summary: Dict[str, int] = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return summary
+
+# User Import
+@dataclass
+class ImportProgress:
+    """Running counts of an NDJSON user import; only a bounded sample of errors is kept"""
+    lines: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    failed: int = 0
+    errors: List[dict] = field(default_factory=list)
+    errors_truncated: bool = False
+    started: float = field(default_factory=time.monotonic)
+
+    def error(self, line: int, message: str, kind: str = "invalid"):
+        setattr(self, kind, getattr(self, kind) + 1)
+        if len(self.errors) < IMPORT_ERROR_SAMPLE:
+            self.errors.append({"line": line, "error": message})
+        else:
+            self.errors_truncated = True
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {"lines": self.lines, "imported": self.imported, "duplicates": self.duplicates,
+                "invalid": self.invalid, "failed": self.failed, "elapsed_seconds": round(elapsed, 3),
+                "errors": self.errors, "errors_truncated": self.errors_truncated}
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """Split a byte stream into numbered lines without holding more than one line.
+
+    Lines longer than IMPORT_MAX_LINE_BYTES are discarded as they arrive and come
+    back as None.
+    """
+    buffer = b""
+    number = 0
+    oversized = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            yield number, None if oversized or len(line) > IMPORT_MAX_LINE_BYTES else line
+            oversized = False
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            buffer = b""
+            oversized = True
+    if oversized or buffer.strip():
+        yield number + 1, None if oversized else buffer
+
+def validation_message(error: ValidationError) -> str:
+    first = error.errors()[0]
+    location = ".".join(str(part) for part in first["loc"])
+    return f"{location}: {first['msg']}" if location else first["msg"]
+
+async def write_import_chunk(chunk: List[Tuple[int, dict]], progress: ImportProgress):
+    """Insert a chunk of validated users, skipping emails already in the chunk or the database"""
+    by_email: Dict[str, Tuple[int, dict]] = {}
+    for number, user in chunk:
+        if user["email"] in by_email:
+            progress.duplicates += 1
+        else:
+            by_email[user["email"]] = (number, user)
+    # Served by the unique email index
+    with span("mongo users.find"):
+        existing = {user["email"] async for user in db.users.find(
+            {"email": {"$in": list(by_email)}}, {"_id": 0, "email": 1})}
+    progress.duplicates += len(existing)
+    pending = [entry for email, entry in by_email.items() if email not in existing]
+    if not pending:
+        return
+
+    with span("mongo users.insert_many"):
+        try:
+            result = await db.users.insert_many([user for _, user in pending], ordered=False)
+            progress.imported += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate keys here are users created since the lookup above
+            progress.imported += e.details.get("nInserted", 0)
+            for write_error in e.details.get("writeErrors", []):
+                if write_error.get("code") == 11000:
+                    progress.duplicates += 1
+                else:
+                    progress.error(pending[write_error["index"]][0], write_error.get("errmsg", "Write failed"),
+                                   kind="failed")
+
+async def import_users(lines: AsyncIterator[Tuple[int, Optional[bytes]]]) -> AsyncIterator[ImportProgress]:
+    """Validate and insert users chunk by chunk, yielding the progress after each chunk"""
+    progress = ImportProgress()
+    chunk: List[Tuple[int, dict]] = []
+    reported = False
+    async for number, line in lines:
+        progress.lines = number
+        if line is None:
+            progress.error(number, f"Line longer than {IMPORT_MAX_LINE_BYTES} bytes")
+            continue
+        if not line.strip():
+            continue
+        try:
+            user = User(**UserCreate.model_validate_json(line).dict())
+        except ValidationError as e:
+            progress.error(number, validation_message(e))
+            continue
+        chunk.append((number, user.dict()))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            await write_import_chunk(chunk, progress)
+            chunk = []
+            reported = True
+            yield progress
+    if chunk:
+        await write_import_chunk(chunk, progress)
+    if chunk or not reported:
+        yield progress
+
+# Database Indexes
+def index_covers(keys: List[Tuple[str, int]], equality: List[str], sort: List[Tuple[str, int]]) -> bool:
+    """True if the index can serve the equality match and then the sort without a scan or in-memory sort"""
+    if len(keys) < len(equality) + len(sort):
+        return False
+    if {field for field, _ in keys[:len(equality)]} != set(equality):
+        return False
+    tail = keys[len(equality):len(equality) + len(sort)]
+    reversed_sort = [(field, -direction) for field, direction in sort]
+    return tail == sort or tail == reversed_sort
+
+def uncovered_declared_queries() -> List[str]:
+    """Describe every query declared in HOT_QUERIES that no index in DB_INDEXES covers"""
+    problems = []
+    for handler, collection, equality, sort in HOT_QUERIES:
+        indexes = [keys for coll, keys, _ in DB_INDEXES if coll == collection]
+        if not any(index_covers(keys, equality, sort) for keys in indexes):
+            problems.append(f"{handler}: {collection} filter={equality} sort={sort}")
+    return problems
+
+async def ensure_indexes():
+    """Idempotently create the declared indexes and flag declared queries they do not cover"""
+    for collection, keys, options in DB_INDEXES:
+        try:
+            name = await db[collection].create_index(keys, **options)
+            logger.info(f"Index ready: {collection}.{name}")
+        except Exception as e:
+            # e.g. duplicate emails already stored; the API keeps working without the index
+            logger.error(f"Index build failed: {collection}.{options['name']}: {e}")
+
+    for problem in uncovered_declared_queries():
+        logger.warning(f"Declared query not covered by an index: {problem}")
 
 # API Routes
 @api_router.get("/")
@@ -171,6 +2321,8 @@ async def signup(user_data: dict):
         user.pop("_id", None)
         
         return {"success": True, "user": user}
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already registered")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -206,116 +2358,439 @@ async def logout():
     return {"success": True, "message": "Logged out successfully"}
 
 @api_router.get("/crypto/prices")
-async def get_crypto_prices(symbols: str = Query(default="BTC,ETH,BNB,ADA,SOL,XRP,DOGE,AVAX,DOT,MATIC")):
+async def get_crypto_prices(symbols: str = Query(default=DEFAULT_PRICE_SYMBOLS)):
     """Get real-time cryptocurrency prices"""
+    requested = parse_symbols(symbols)
+    snapshot = price_worker.snapshot
+    if snapshot is not None and price_worker.tracked.issuperset(requested):
+        def build():
+            return {
+                "prices": {s: snapshot.quotes[s] for s in requested if s in snapshot.quotes},
+                "missing": [s for s in requested if s not in snapshot.quotes],
+                "unknown": [s for s in requested if not symbol_index.is_known(s)],
+                "timestamp": snapshot.fetched_at.isoformat(),
+                "stale_age": None
+            }
+
+        oldest = min((snapshot.quoted_at[s] for s in requested if s in snapshot.quoted_at),
+                     default=snapshot.fetched_at)
+        age = stale_age((datetime.utcnow() - oldest).total_seconds())
+        if age is not None:
+            # Refreshes are failing for some of these: still serve the last good quotes, but say how old they are
+            return FastJSONResponse({**build(), "stale_age": age})
+        # Every client polling the same symbols gets the same pre-encoded body
+        return FastJSONResponse(snapshot.encode(("prices",) + tuple(requested), build))
+
     prices = await CoinMarketCapService.get_crypto_prices(symbols)
-    return {"prices": prices, "timestamp": datetime.utcnow().isoformat()}
+    return FastJSONResponse({
+        "prices": prices,
+        "missing": [s for s in requested if s not in prices],
+        "unknown": [s for s in requested if not symbol_index.is_known(s)],
+        "timestamp": datetime.utcnow().isoformat(),
+        "stale_age": stale_age(CoinMarketCapService.quote_age(list(prices)))
+    })
+
+@api_router.get("/crypto/{symbol}/candles")
+async def get_candles(
+    symbol: str,
+    interval: Optional[str] = Query(default=None, description="1m, 1h or 1d; picked from the range when omitted"),
+    start: Optional[datetime] = Query(default=None, description="Defaults to 7 days before `end`"),
+    end: Optional[datetime] = Query(default=None, description="Defaults to now"),
+    limit: int = Query(default=CANDLE_MAX_POINTS, ge=1, le=CANDLE_MAX_POINTS)
+):
+    """OHLC candles for a symbol, read from one pre-aggregated tier (times are UTC)"""
+    symbol = symbol.upper()
+    if not CURRENCY_CODE.match(symbol):
+        raise HTTPException(status_code=400, detail="Invalid symbol")
+    if interval is not None and interval not in CANDLE_TIERS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(CANDLE_TIERS)}")
+    end = naive_utc(end) or datetime.utcnow()
+    start = naive_utc(start) or end - timedelta(days=7)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    interval = interval or price_history.pick_interval(start, end)
+    with span("mongo price_candles.find"):
+        candles = await price_history.candles(symbol, interval, start, end, limit)
+    return FastJSONResponse({"symbol": symbol, "interval": interval, "candles": candles})
 
 @api_router.get("/crypto/trending")
 async def get_trending():
     """Get top trending cryptocurrencies"""
-    prices = await CoinMarketCapService.get_crypto_prices("BTC,ETH,BNB,ADA,SOL,XRP,DOGE,AVAX,DOT,MATIC,LINK,UNI,LTC,BCH,ATOM")
-    
-    # Sort by market cap descending, handle None values
-    trending = sorted(prices.values(), key=lambda x: x.get("market_cap", 0) or 0, reverse=True)[:10]
-    return {"trending": trending}
+    snapshot = price_worker.snapshot
+    if snapshot is not None:
+        return FastJSONResponse(snapshot.encode(("trending",), lambda: {"trending": list(snapshot.trending)}))
+
+    prices = await CoinMarketCapService.get_crypto_prices(TRENDING_SYMBOLS)
+    return FastJSONResponse({"trending": rank_trending(prices.values())})
+
+def price_stream_message(prices: Dict[str, dict]) -> dict:
+    snapshot = price_worker.snapshot
+    timestamp = snapshot.fetched_at if snapshot is not None else datetime.utcnow()
+    return {"prices": prices, "timestamp": timestamp.isoformat()}
+
+@api_router.websocket("/crypto/stream")
+async def crypto_price_stream(websocket: WebSocket, symbols: Optional[str] = None):
+    """Push changed prices over a WebSocket.
+
+    Clients may change their subscription by sending {"symbols": "BTC,ETH"};
+    an empty value subscribes to every tracked symbol.
+    """
+    await websocket.accept()
+    try:
+        subscriber = price_hub.subscribe(parse_symbols(symbols) if symbols else None)
+    except HTTPException as e:
+        await websocket.close(code=1013, reason=e.detail)
+        return
+
+    async def send_updates():
+        while True:
+            prices = await subscriber.next()
+            await websocket.send_text(dumps_json(price_stream_message(prices)).decode())
+
+    async def receive_subscriptions():
+        while True:
+            message = await websocket.receive_json()
+            requested = message.get("symbols") if isinstance(message, dict) else None
+            price_hub.resubscribe(subscriber, parse_symbols(requested) if requested else None)
+
+    tasks = [asyncio.create_task(send_updates()), asyncio.create_task(receive_subscriptions())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        price_hub.unsubscribe(subscriber)
+        for task in tasks:
+            if task.done() and not task.cancelled():
+                # Retrieve the disconnect (or send error) so it is not reported as unhandled
+                task.exception()
+            task.cancel()
+
+@api_router.get("/crypto/stream")
+async def crypto_price_event_stream(request: Request, symbols: Optional[str] = None):
+    """Server-Sent Events fallback for the price stream"""
+    subscriber = price_hub.subscribe(parse_symbols(symbols) if symbols else None)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    prices = await asyncio.wait_for(subscriber.next(), timeout=PRICE_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"data: " + dumps_json(price_stream_message(prices)) + b"\n\n"
+        finally:
+            price_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @api_router.post("/users", response_model=User)
 async def create_user(user_data: UserCreate):
     """Create a new user"""
     user = User(**user_data.dict())
-    await db.users.insert_one(user.dict())
+    try:
+        await db.users.insert_one(user.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already registered")
     return user
 
+@api_router.post("/users/import")
+async def import_users_ndjson(request: Request):
+    """Create users from an NDJSON upload, one {"email", "name"} object per line.
+
+    The body is parsed as it arrives and written in chunks, so memory use does not
+    grow with the upload. Emails that already exist (or repeat within the upload)
+    are counted as duplicates and skipped. Progress is logged per chunk and the
+    response is the final summary.
+    """
+    async for progress in import_users(ndjson_lines(request.stream())):
+        logger.info(f"User import: {progress.lines} lines read, {progress.imported} imported, "
+                    f"{progress.duplicates} duplicates, {progress.invalid + progress.failed} errors")
+    return FastJSONResponse(progress.summary())
+
 @api_router.get("/users/{user_id}", response_model=User)
 async def get_user(user_id: str):
     """Get user by ID"""
-    user_data = await db.users.find_one({"id": user_id})
+    user_data = await load_user(user_id)
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
     return User(**user_data)
 
+@api_router.get("/users/{user_id}/portfolio/valuation")
+async def get_portfolio_valuation(user_id: str):
+    """Value a user's balances and holdings in USD, EUR and TRY with weights and 24h P&L"""
+    user_data = await load_user(user_id)
+    if not user_data:
+        raise HTTPException(status_code=404, detail="User not found")
+    valuation = await value_portfolios([user_data], include_assets=True)
+    return FastJSONResponse(valuation[0])
+
+@api_router.post("/portfolio/valuations")
+async def bulk_portfolio_valuation(valuation_request: PortfolioValuationRequest):
+    """Value many users in one pass (batch jobs); per-asset rows only when include_assets is set"""
+    user_ids = list(dict.fromkeys(valuation_request.user_ids))
+    with span("mongo users.find"):
+        users = await db.users.find(
+            {"id": {"$in": user_ids}},
+            {"_id": 0, "id": 1, "crypto_portfolio": 1, **{field: 1 for field in FIAT_BALANCE_FIELDS.values()}}
+        ).to_list(len(user_ids))
+    valuations = await value_portfolios(users, valuation_request.include_assets)
+    found = {user["id"] for user in users}
+    return FastJSONResponse({
+        "valuations": valuations,
+        "not_found": [user_id for user_id in user_ids if user_id not in found]
+    })
+
+@api_router.post("/swap/quote")
+async def create_swap_quote(quote_request: SwapQuoteRequest):
+    """Lock a swap rate for a short time; execute it with POST /swap and the returned quote_id"""
+    priced = await price_swap(quote_request.from_currency, quote_request.to_currency, quote_request.amount)
+    quote = swap_quotes.issue({"user_id": quote_request.user_id, **priced})
+    return {"success": True, **quote}
+
 @api_router.post("/swap")
 async def crypto_swap(swap_request: SwapRequest):
     """Simulate cryptocurrency swap"""
     try:
-        # Get exchange rate
-        exchange_rate = await CoinMarketCapService.get_exchange_rate(
-            swap_request.from_currency, 
-            swap_request.to_currency
-        )
-        
-        # Calculate receive amount (with 0.5% fee)
-        fee = 0.005
-        receive_amount = (swap_request.amount * exchange_rate) * (1 - fee)
-        
-        # Create transaction record
+        if swap_request.quote_id is not None:
+            # Execute a firm quote: the rate is locked, so no price lookup is needed.
+            # It is checked before it is used up, so a mismatched request cannot burn it
+            priced = swap_quotes.peek(swap_request.quote_id)
+            if priced is None:
+                raise HTTPException(status_code=410, detail="Quote expired or not found")
+            if priced["user_id"] != swap_request.user_id:
+                raise HTTPException(status_code=400, detail="Quote was issued for a different user")
+            for name in ("from_currency", "to_currency", "amount"):
+                requested = getattr(swap_request, name)
+                if requested is not None and requested != priced[name]:
+                    raise HTTPException(status_code=400, detail=f"Quote does not match {name}")
+            if swap_quotes.take(swap_request.quote_id) is None:
+                raise HTTPException(status_code=410, detail="Quote expired or not found")
+        else:
+            # Get exchange rate from the precomputed cross-rate matrix
+            priced = await price_swap(swap_request.from_currency, swap_request.to_currency, swap_request.amount)
+
+        from_currency = priced["from_currency"]
+        to_currency = priced["to_currency"]
+        amount = priced["amount"]
+        exchange_rate = priced["exchange_rate"]
+        receive_amount = priced["receive_amount"]
+
         transaction = Transaction(
             user_id=swap_request.user_id,
             transaction_type="crypto_swap",
-            from_currency=swap_request.from_currency,
-            to_currency=swap_request.to_currency,
-            from_amount=swap_request.amount,
+            from_currency=from_currency,
+            to_currency=to_currency,
+            from_amount=amount,
             to_amount=receive_amount,
             exchange_rate=exchange_rate
         )
-        
-        await db.transactions.insert_one(transaction.dict())
-        
-        # Update user portfolio (simplified - in real app, check user balance first)
-        user_data = await db.users.find_one({"id": swap_request.user_id})
-        if user_data:
-            portfolio = user_data.get("crypto_portfolio", {})
-            
-            # Subtract from currency
-            from_balance = portfolio.get(swap_request.from_currency, 0)
-            if from_balance >= swap_request.amount:
-                portfolio[swap_request.from_currency] = from_balance - swap_request.amount
-                
-                # Add to currency
-                to_balance = portfolio.get(swap_request.to_currency, 0)
-                portfolio[swap_request.to_currency] = to_balance + receive_amount
-                
-                # Update user
-                await db.users.update_one(
-                    {"id": swap_request.user_id},
-                    {"$set": {"crypto_portfolio": portfolio}}
-                )
-        
-        return {
+        from_field = holding_field(from_currency)
+        update = {"$inc": {from_field: -amount, holding_field(to_currency): receive_amount}}
+        moved = False
+        try:
+            async with transaction_writer.slot() as write_transaction:
+                # Move the funds in a single conditional $inc. The balance guard lives in the
+                # filter, so concurrent swaps by the same user can neither overdraw nor lose
+                # each other's updates
+                with span("mongo users.find_one_and_update"):
+                    user_data = await db.users.find_one_and_update(
+                        {"id": swap_request.user_id, from_field: {"$gte": amount}},
+                        ledger_update(update, transaction.id, transaction_deltas(transaction.dict())),
+                        projection={"_id": 0},
+                        return_document=ReturnDocument.AFTER
+                    )
+                if user_data is None:
+                    # Nothing moved, so nothing is recorded; the queue slot is given back on exit
+                    with span("mongo users.find_one"):
+                        exists = await db.users.find_one({"id": swap_request.user_id}, {"_id": 0, "id": 1})
+                    if exists is None:
+                        raise HTTPException(status_code=404, detail="User not found")
+                    raise HTTPException(status_code=409, detail="Insufficient balance")
+                moved = True
+                user_cache.put(swap_request.user_id, user_data)
+                transaction.seq = user_data["ledger"]["seq"]
+
+                recorded = await write_transaction(transaction.dict())
+        except HTTPException:
+            if swap_request.quote_id is not None and not moved:
+                # The swap was refused before any funds moved: the firm quote stays usable for a retry
+                swap_quotes.restore(priced)
+            raise
+
+        body = {
             "success": True,
             "transaction_id": transaction.id,
             "exchange_rate": exchange_rate,
             "receive_amount": receive_amount,
-            "fee_percentage": fee * 100
+            "fee_percentage": priced["fee_percentage"],
+            "rate_as_of": priced["rate_as_of"],
+            "rate_age_seconds": priced["rate_age_seconds"],
+            "rate_stale": priced["rate_stale"],
+            "quote_id": swap_request.quote_id,
+            "portfolio_updated": True,
+            "transaction_recorded": recorded
         }
+        # The swap happened even if its record was lost: 202 rather than an error a client would retry
+        return body if recorded else FastJSONResponse(body, status_code=202)
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Swap failed: {str(e)}")
 
+def encode_cursor(transaction: dict) -> str:
+    raw = f"{transaction['timestamp'].isoformat()}|{transaction['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        timestamp, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), transaction_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+TRANSACTION_FIELDS = list(Transaction.model_fields)
+
+def transaction_filter(user_id: str, currency: Optional[str], transaction_type: Optional[str],
+                       since: Optional[datetime], until: Optional[datetime]) -> List[dict]:
+    """Build the query clauses shared by the history and export endpoints"""
+    clauses: List[dict] = [{"user_id": user_id}]
+    if transaction_type:
+        clauses.append({"transaction_type": transaction_type})
+    if currency:
+        clauses.append({"$or": [{"from_currency": currency}, {"to_currency": currency}]})
+    if since or until:
+        time_range = {}
+        if since:
+            time_range["$gte"] = since
+        if until:
+            time_range["$lt"] = until
+        clauses.append({"timestamp": time_range})
+    return clauses
+
+def parse_field_list(fields: str) -> List[str]:
+    return [f.strip() for f in fields.split(",") if f.strip()]
+
 @api_router.get("/users/{user_id}/transactions")
-async def get_user_transactions(user_id: str):
-    """Get user transaction history"""
-    transactions = await db.transactions.find({"user_id": user_id}).sort("timestamp", -1).to_list(100)
-    return {"transactions": [Transaction(**t) for t in transactions]}
+async def get_user_transactions(
+    user_id: str,
+    limit: int = Query(default=100, ge=1, le=500),
+    before: Optional[str] = Query(default=None, description="next_cursor from the previous page"),
+    currency: Optional[str] = Query(default=None, description="Match either side of the transaction"),
+    transaction_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = Query(default=None, description="Comma-separated subset of transaction fields")
+):
+    """Get user transaction history, newest first, with keyset pagination on (timestamp, id)"""
+    clauses = transaction_filter(user_id, currency, transaction_type, since, until)
+    if before:
+        timestamp, transaction_id = decode_cursor(before)
+        clauses.append({"$or": [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "id": {"$lt": transaction_id}}
+        ]})
+
+    if fields:
+        selected = [f for f in parse_field_list(fields) if f in TRANSACTION_FIELDS]
+        # The cursor is built from these two, so they are always returned
+        selected = list(dict.fromkeys(["id", "timestamp"] + selected))
+    else:
+        selected = TRANSACTION_FIELDS
+    projection = {"_id": 0, **{field: 1 for field in selected}}
+
+    query = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    # Fetch one extra row to know whether another page exists
+    with span("mongo transactions.find"):
+        transactions = await db.transactions.find(query, projection) \
+            .sort([("timestamp", -1), ("id", -1)]) \
+            .limit(limit + 1) \
+            .to_list(limit + 1)
+
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_cursor(transactions[-1])
+
+    # Rows are already shaped by the projection, so they are encoded directly
+    # instead of being rebuilt as Transaction models
+    return FastJSONResponse({"transactions": transactions, "next_cursor": next_cursor})
+
+@api_router.get("/users/{user_id}/transactions/export")
+async def export_user_transactions(
+    user_id: str,
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    currency: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """Stream the full transaction history, oldest first, as NDJSON or CSV.
+
+    Rows are read from a Motor cursor in batches and flushed chunk by chunk, so
+    memory use stays constant however many transactions the user has.
+    """
+    clauses = transaction_filter(user_id, currency, transaction_type, since, until)
+    query = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    cursor = db.transactions.find(query, {"_id": 0, **{field: 1 for field in TRANSACTION_FIELDS}}) \
+        .sort([("timestamp", 1), ("id", 1)]) \
+        .batch_size(EXPORT_BATCH_SIZE)
+
+    def ndjson_row(transaction: dict) -> str:
+        transaction["timestamp"] = transaction["timestamp"].isoformat()
+        return json.dumps(transaction) + "\n"
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=TRANSACTION_FIELDS, extrasaction="ignore")
+
+    def drain_buffer() -> str:
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return text
+
+    def csv_row(transaction: dict) -> str:
+        transaction["timestamp"] = transaction["timestamp"].isoformat()
+        writer.writerow(transaction)
+        return drain_buffer()
+
+    render = csv_row if format == "csv" else ndjson_row
+
+    async def rows():
+        try:
+            if format == "csv":
+                writer.writeheader()
+                yield drain_buffer()
+            chunk = []
+            async for transaction in cursor:
+                chunk.append(render(transaction))
+                if len(chunk) >= EXPORT_BATCH_SIZE:
+                    yield "".join(chunk)
+                    chunk = []
+            if chunk:
+                yield "".join(chunk)
+        finally:
+            await cursor.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"transactions-{user_id}.{format}"
+    return StreamingResponse(rows(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 @api_router.post("/users/{user_id}/topup")
 async def fiat_topup(user_id: str, currency: str, amount: float):
     """Simulate fiat currency top-up"""
-    user_data = await db.users.find_one({"id": user_id})
-    if not user_data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if currency == "EUR":
-        new_balance = user_data.get("eur_balance", 0) + amount
-        await db.users.update_one({"id": user_id}, {"$set": {"eur_balance": new_balance}})
-    elif currency == "TRY":
-        new_balance = user_data.get("try_balance", 0) + amount
-        await db.users.update_one({"id": user_id}, {"$set": {"try_balance": new_balance}})
-    else:
+    balance_field = FIAT_BALANCE_FIELDS.get(currency)
+    if balance_field is None:
         raise HTTPException(status_code=400, detail="Invalid currency")
-    
-    # Create transaction record
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+
     transaction = Transaction(
         user_id=user_id,
         transaction_type="fiat_topup",
@@ -325,20 +2800,297 @@ async def fiat_topup(user_id: str, currency: str, amount: float):
         to_amount=amount,
         exchange_rate=1.0
     )
-    await db.transactions.insert_one(transaction.dict())
-    
-    return {"success": True, "new_balance": new_balance, "currency": currency}
+    async with transaction_writer.slot() as write_transaction:
+        # Atomic increment (and ledger entry) that also returns the new balance in the same round trip
+        with span("mongo users.find_one_and_update"):
+            user_data = await db.users.find_one_and_update(
+                {"id": user_id},
+                ledger_update({"$inc": {balance_field: amount}}, transaction.id, {currency: amount}),
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+        if not user_data:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_cache.put(user_id, user_data)
+        new_balance = user_data[balance_field]
+        transaction.seq = user_data["ledger"]["seq"]
+
+        recorded = await write_transaction(transaction.dict())
+
+    body = {"success": True, "new_balance": new_balance, "currency": currency, "transaction_recorded": recorded}
+    # As in crypto_swap, a lost record is not an error: the balance has changed
+    return body if recorded else FastJSONResponse(body, status_code=202)
+
+@api_router.post("/bulk/topups")
+async def bulk_topups(bulk_request: BulkTopupRequest):
+    """Apply many fiat top-ups in one request; results are per item, in request order.
+
+    Items for the same user are applied in order. Every user's items are written
+    with a single bulk_write and every transaction with a single insert_many.
+    """
+    operations = []
+    for index, item in enumerate(bulk_request.items):
+        result = {"index": index, "reference": item.reference, "user_id": item.user_id}
+        operation = BulkOperation(index=index, result=result)
+        balance_field = FIAT_BALANCE_FIELDS.get(item.currency)
+        if balance_field is None:
+            result.update(status="invalid", error="Invalid currency")
+        elif item.amount <= 0:
+            result.update(status="invalid", error="Amount must be positive")
+        else:
+            operation.transaction = Transaction(
+                user_id=item.user_id, transaction_type="fiat_topup", from_currency="BANK", to_currency=item.currency,
+                from_amount=item.amount, to_amount=item.amount, exchange_rate=1.0
+            )
+            operation.changes = {balance_field: item.amount}
+            operation.balance_field = balance_field
+            result["currency"] = item.currency
+        operations.append(operation)
+
+    results = await execute_bulk(operations)
+    return FastJSONResponse({"results": results, "summary": bulk_summary(results)})
+
+@api_router.post("/bulk/swaps")
+async def bulk_swaps(bulk_request: BulkSwapRequest):
+    """Execute many swaps against one rate snapshot; results are per item, in request order.
+
+    An item the user's balance cannot cover (after their earlier items) is rejected
+    and not recorded.
+    """
+    items = bulk_request.items
+    errors = [swap_request_error(item.from_currency, item.to_currency, item.amount) for item in items]
+    symbols = sorted({symbol for item, error in zip(items, errors) if error is None
+                      for symbol in (item.from_currency, item.to_currency)
+                      if symbol in FIAT_USD_RATES or symbol_index.is_known(symbol)})
+    with span("exchange_rate"):
+        rates, _ = await valuation_rates(symbols)
+    as_of = rates.as_of(symbols)
+    age = (datetime.utcnow() - as_of).total_seconds()
+
+    operations = []
+    for index, (item, error) in enumerate(zip(items, errors)):
+        result = {"index": index, "reference": item.reference, "user_id": item.user_id}
+        operation = BulkOperation(index=index, result=result)
+        rate = rates.rate(item.from_currency, item.to_currency) if error is None else None
+        if error is None and rate is None:
+            error = f"Unsupported currency pair: {item.from_currency}/{item.to_currency}"
+        if error is not None:
+            result.update(status="invalid", error=error)
+        else:
+            receive_amount = (item.amount * rate) * (1 - SWAP_FEE)
+            operation.transaction = Transaction(
+                user_id=item.user_id, transaction_type="crypto_swap", from_currency=item.from_currency,
+                to_currency=item.to_currency, from_amount=item.amount, to_amount=receive_amount, exchange_rate=rate
+            )
+            from_field = holding_field(item.from_currency)
+            operation.changes = {from_field: -item.amount, holding_field(item.to_currency): receive_amount}
+            operation.debit = (from_field, item.amount)
+            result.update(exchange_rate=rate, receive_amount=receive_amount)
+        operations.append(operation)
+
+    results = await execute_bulk(operations)
+    return FastJSONResponse({
+        "results": results,
+        "summary": bulk_summary(results),
+        "fee_percentage": SWAP_FEE * 100,
+        "rate_as_of": as_of.isoformat(),
+        "rate_age_seconds": age,
+        "rate_stale": age > RATE_MAX_AGE
+    })
+
+@api_router.get("/users/{user_id}/ledger")
+async def get_ledger(user_id: str):
+    """Running per-currency totals of the user's transactions and the last reconciled checkpoint"""
+    user_data = await load_user(user_id)
+    if not user_data:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"user_id": user_id, **ledger_summary(user_data)}
+
+@api_router.post("/users/{user_id}/ledger/reconcile")
+async def reconcile_user_ledger(user_id: str):
+    """Verify the ledger against the transactions recorded since the last checkpoint"""
+    # Read past the cache: the check must start from the latest committed sequence number
+    with span("mongo users.find_one"):
+        user_data = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user_data:
+        raise HTTPException(status_code=404, detail="User not found")
+    return FastJSONResponse(await reconcile_ledger(user_data))
+
+@api_router.get("/users/{user_id}/statement")
+async def get_statement(user_id: str, after_seq: Optional[int] = Query(default=None, ge=0)):
+    """Opening totals, the transactions since, and closing totals.
+
+    Opens at the last reconciled checkpoint by default; an earlier after_seq is only
+    accepted when it is the checkpoint, since no totals are kept for other positions.
+    """
+    user_data = await load_user(user_id)
+    if not user_data:
+        raise HTTPException(status_code=404, detail="User not found")
+    summary = ledger_summary(user_data)
+    checkpoint = summary["checkpoint"]
+    if after_seq is not None and after_seq != checkpoint["seq"]:
+        raise HTTPException(status_code=400, detail=f"Statements open at the checkpoint (seq {checkpoint['seq']})")
+    upto_seq = min(summary["seq"], checkpoint["seq"] + LEDGER_STATEMENT_MAX)
+    with span("mongo transactions.find"):
+        transactions = await ledger_entries(user_id, checkpoint["seq"], upto_seq).to_list(LEDGER_STATEMENT_MAX)
+    balances = dict(checkpoint["totals"])
+    for transaction in transactions:
+        for currency, delta in transaction_deltas(transaction).items():
+            balances[currency] = balances.get(currency, 0.0) + delta
+        transaction["totals"] = dict(balances)
+    return FastJSONResponse({
+        "user_id": user_id,
+        "opening": {"seq": checkpoint["seq"], "totals": checkpoint["totals"], "at": checkpoint["at"]},
+        "transactions": transactions,
+        "closing": {"seq": upto_seq, "totals": balances},
+        "truncated": upto_seq < summary["seq"]
+    })
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats():
+    """Hit/miss/eviction counters for the in-process caches"""
+    return {
+        "user_cache": user_cache.stats(),
+        "price_cache": {
+            "size": len(price_cache),
+            "hits": price_cache.hits,
+            "misses": price_cache.misses,
+            "coalesced": price_cache.coalesced,
+            "stale_served": price_cache.stale_served,
+            "upstream_fetches": price_cache.upstream_fetches
+        },
+        "coinmarketcap_circuit": cmc_breaker.stats(),
+        "transaction_writer": transaction_writer.stats()
+    }
+
+@api_router.get("/admin/tracing")
+async def get_tracing():
+    """Current request tracing settings and counters"""
+    return request_tracer.stats()
+
+@api_router.post("/admin/tracing")
+async def update_tracing(settings: TracingSettings):
+    """Turn slow-request tracing on or off, or change its sampling, without a restart"""
+    request_tracer.configure(settings.enabled, settings.sample_rate, settings.slow_ms)
+    logger.info(f"Request tracing updated: {request_tracer.stats()}")
+    return request_tracer.stats()
 
 @api_router.get("/exchange-rates")
 async def get_exchange_rates():
     """Get current exchange rates between major currencies"""
     return {
         "EUR_TRY": 34.2,
-        "USD_EUR": 0.92,
-        "USD_TRY": 31.5,
+        "USD_EUR": FIAT_USD_RATES["EUR"],
+        "USD_TRY": FIAT_USD_RATES["TRY"],
         "timestamp": datetime.utcnow().isoformat()
     }
 
+# Metrics endpoint and request timing
+CACHE_LOOKUPS = CallbackMetric(
+    "cache_lookups_total", "In-process cache lookups by result (coalesced = joined an in-flight fetch)", "counter",
+    ("cache", "result"),
+    lambda: [(("price", "hit"), price_cache.hits), (("price", "miss"), price_cache.misses),
+             (("price", "coalesced"), price_cache.coalesced), (("price", "stale"), price_cache.stale_served),
+             (("user", "hit"), user_cache.hits), (("user", "miss"), user_cache.misses)]
+)
+CACHE_ENTRIES = CallbackMetric(
+    "cache_entries", "Entries held by each in-process cache", "gauge", ("cache",),
+    lambda: [(("price",), len(price_cache)), (("user",), user_cache.stats()["size"]),
+             (("swap_quote",), len(swap_quotes))]
+)
+PRICE_SNAPSHOT_AGE = CallbackMetric(
+    "price_snapshot_age_seconds", "Age of the ingestion worker's price snapshot", "gauge", (),
+    lambda: [((), (datetime.utcnow() - price_worker.snapshot.fetched_at).total_seconds())]
+    if price_worker.snapshot is not None else []
+)
+
+CMC_CIRCUIT_STATE = CallbackMetric(
+    "coinmarketcap_circuit_state", "CoinMarketCap circuit breaker state (0 closed, 1 half-open, 2 open)", "gauge", (),
+    lambda: [((), {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}[cmc_breaker.state])]
+)
+CMC_CIRCUIT_EVENTS = CallbackMetric(
+    "coinmarketcap_circuit_events_total", "Times the circuit opened, and calls rejected while open", "counter",
+    ("event",),
+    lambda: [(("opened",), cmc_breaker.opened_total), (("rejected",), cmc_breaker.rejected_total)]
+)
+
+TRANSACTION_QUEUE_DEPTH = CallbackMetric(
+    "transaction_queue_depth", "Transaction records queued for a batched insert", "gauge", (),
+    lambda: [((), transaction_writer.depth())]
+)
+TRANSACTION_WRITES = CallbackMetric(
+    "transaction_writes_total", "Transaction record writes by outcome (rejected = queue full, answered 503)",
+    "counter", ("result",),
+    lambda: [(("written",), transaction_writer.written), (("failed",), transaction_writer.failed),
+             (("rejected",), transaction_writer.rejected)]
+)
+
+def route_label(scope) -> str:
+    """Route template for a request, so path parameters do not explode label cardinality"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    endpoint = scope.get("endpoint")
+    for candidate in app.routes:
+        if endpoint is not None and getattr(candidate, "endpoint", None) is endpoint:
+            return candidate.path
+    return "unmatched"
+
+class RequestMetricsMiddleware:
+    """Per-route latency histogram (plain ASGI, so streamed responses are not buffered)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope["method"], route_label(scope), str(status))
+
+class RequestTracingMiddleware:
+    """Traces a sampled fraction of requests while tracing is enabled (see RequestTracer)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        trace = request_tracer.start(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_trace.reset(token)
+            request_tracer.finish(trace, route_label(scope), status)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint (served outside /api, for scrapers rather than the frontend)"""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -349,6 +3101,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(RequestTracingMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -357,6 +3111,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_indexes():
+    await ensure_indexes()
+    transaction_writer.start()
+    if PRICE_HISTORY_ENABLED:
+        await price_history.ensure_collections()
+
+@app.on_event("startup")
+async def startup_http_client():
+    CoinMarketCapService.start()
+    symbol_index.load()
+    symbol_index.start()
+    if PRICE_INGESTION_ENABLED:
+        price_worker.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await price_worker.stop()
+    await symbol_index.stop()
+    await transaction_writer.stop()
+    await CoinMarketCapService.close()
+    client.close()
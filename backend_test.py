@@ -24,6 +24,8 @@ class BackendTester:
     def __init__(self):
         self.test_results = []
         self.created_user_id = None
+        # Emails are unique per user, so every run registers a fresh address
+        self.user_email = f"alice.johnson+{uuid.uuid4().hex[:8]}@example.com"
         
     def log_test(self, test_name, success, details="", response_data=None):
         """Log test results"""
@@ -193,7 +195,7 @@ class BackendTester:
         """Test POST /api/users"""
         try:
             user_data = {
-                "email": "alice.johnson@example.com",
+                "email": self.user_email,
                 "name": "Alice Johnson"
             }
             
@@ -242,7 +244,7 @@ class BackendTester:
                 data = response.json()
                 
                 # Verify it's the same user
-                if data.get("id") == self.created_user_id and data.get("email") == "alice.johnson@example.com":
+                if data.get("id") == self.created_user_id and data.get("email") == self.user_email:
                     self.log_test("Get User", True, f"Successfully retrieved user: {data['name']}", {"user_id": self.created_user_id})
                     return True
                 else:
@@ -267,11 +269,18 @@ class BackendTester:
             return False
             
         try:
+            # A swap only succeeds against a balance that covers it, so fund the new user first
+            response = requests.post(f"{API_BASE_URL}/users/{self.created_user_id}/topup",
+                                     params={"currency": "EUR", "amount": 1000})
+            if response.status_code != 200:
+                self.log_test("Crypto Swap", False, f"Top-up failed: HTTP {response.status_code}", response.text)
+                return False
+
             swap_data = {
                 "user_id": self.created_user_id,
-                "from_currency": "BTC",
-                "to_currency": "ETH",
-                "amount": 0.1
+                "from_currency": "EUR",
+                "to_currency": "BTC",
+                "amount": 100
             }
             
             response = requests.post(f"{API_BASE_URL}/swap", json=swap_data)
@@ -299,7 +308,12 @@ class BackendTester:
                     self.log_test("Crypto Swap", False, "Invalid exchange rate or receive amount", data)
                     return False
                 
-                details = f"Swapped 0.1 BTC to {receive_amount:.6f} ETH (rate: {exchange_rate:.4f})"
+                user = requests.get(f"{API_BASE_URL}/users/{self.created_user_id}").json()
+                if abs(user["eur_balance"] - 900) > 1e-6:
+                    self.log_test("Crypto Swap", False, f"EUR balance {user['eur_balance']}, expected 900", user)
+                    return False
+                
+                details = f"Swapped 100 EUR to {receive_amount:.6f} BTC (rate: {exchange_rate:.8f})"
                 self.log_test("Crypto Swap", True, details, data)
                 return True
                 
@@ -385,7 +399,22 @@ class BackendTester:
         except Exception as e:
             print(f"    ❌ Error testing invalid swap: {e}")
         
-        # Test 3: Invalid crypto symbols
+        # Test 3: Swap the balance cannot cover
+        if self.created_user_id:
+            total_tests += 1
+            try:
+                overdraft_swap = {"user_id": self.created_user_id, "from_currency": "ETH",
+                                  "to_currency": "BTC", "amount": 1000}
+                response = requests.post(f"{API_BASE_URL}/swap", json=overdraft_swap)
+                if response.status_code == 409:
+                    tests_passed += 1
+                    print("    ✅ Uncovered swap returns 409")
+                else:
+                    print(f"    ❌ Uncovered swap returned {response.status_code}, expected 409")
+            except Exception as e:
+                print(f"    ❌ Error testing uncovered swap: {e}")
+        
+        # Test 4: Invalid crypto symbols
         total_tests += 1
         try:
             response = requests.get(f"{API_BASE_URL}/crypto/prices?symbols=INVALID,FAKE")
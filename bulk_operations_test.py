@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Bulk Operations Test for Akka Fintech
+Runs /api/bulk/topups and /api/bulk/swaps in-process against the in-memory Mongo
+stand-in (mongomock-motor) and the fake CoinMarketCap server, and checks item
+statuses, in-order debits, conflict retries and the users' ledger sequence.
+
+Concurrent writers are simulated by landing a real top-up or swap between the
+bulk request's read of a user and its bulk_write.
+"""
+
+import logging
+import os
+import sys
+import uuid
+
+import harness
+from harness import report, server
+
+try:
+    import mongomock_motor
+    from pymongo.results import BulkWriteResult
+except ImportError:
+    sys.exit("mongomock-motor is not installed: pip install mongomock-motor")
+from fastapi.testclient import TestClient  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("server").setLevel(logging.ERROR)
+
+UPSTREAM_PORT = int(os.environ.get('BULK_TEST_UPSTREAM_PORT', '8768'))
+
+# Coroutine functions run one per bulk_write, before it applies: writes by "another client"
+CONCURRENT_WRITES = []
+# ... and after it applied, before execute_bulk checks which users' updates landed
+LATE_WRITES = []
+
+
+async def stand_in_bulk_write(self, requests, ordered=True, **kwargs):
+    """bulk_write for the stand-in, which does not accept this pymongo's UpdateOne.
+
+    Applies each request with update_one (UpdateOne keeps its filter and update in
+    _filter and _doc), between the next queued concurrent and late writes, if any.
+    """
+    if CONCURRENT_WRITES:
+        await CONCURRENT_WRITES.pop(0)()
+    matched = 0
+    for request in requests:
+        matched += (await self.update_one(request._filter, request._doc)).matched_count
+    if LATE_WRITES:
+        await LATE_WRITES.pop(0)()
+    return BulkWriteResult({"nMatched": matched, "nModified": matched, "upserted": []}, True)
+
+
+def create_user(c, **balances):
+    user_id = c.post("/api/users", json={"email": f"bulk-{uuid.uuid4().hex[:8]}@akka.test",
+                                         "name": "Bulk Test"}).json()["id"]
+    if balances:
+        c.portal.call(server.db.users.update_one, {"id": user_id}, {"$set": balances})
+        server.user_cache.invalidate(user_id)
+    return user_id
+
+
+def user_doc(c, user_id):
+    return c.portal.call(server.db.users.find_one, {"id": user_id}, {"_id": 0})
+
+
+def check_bulk_topups(c):
+    print("1. BULK TOP-UPS")
+    print("-" * 50)
+    user_a, user_b = create_user(c), create_user(c)
+    response = c.post("/api/bulk/topups", json={"items": [
+        {"user_id": user_a, "currency": "EUR", "amount": 10, "reference": "first"},
+        {"user_id": user_a, "currency": "EUR", "amount": 5},
+        {"user_id": user_a, "currency": "TRY", "amount": 7},
+        {"user_id": user_b, "currency": "USD", "amount": 1},
+        {"user_id": user_b, "currency": "EUR", "amount": -1},
+        {"user_id": "no-such-user", "currency": "EUR", "amount": 1}
+    ]}).json()
+    results = response["results"]
+    statuses = [result["status"] for result in results]
+    print(f"Statuses: {statuses}")
+    print(f"Summary: {response['summary']}")
+
+    user = user_doc(c, user_a)
+    passed = (
+        statuses == ["applied", "applied", "applied", "invalid", "invalid", "not_found"]
+        and results[0]["reference"] == "first"
+        and [result.get("new_balance") for result in results[:3]] == [10.0, 15.0, 7.0]
+        and all(result["transaction_recorded"] for result in results[:3])
+        and user["eur_balance"] == 15.0 and user["try_balance"] == 7.0
+        and user_doc(c, user_b)["eur_balance"] == 0.0
+    )
+    return report(passed, "statuses, running balances and stored balances match",
+                  "unexpected statuses or balances")
+
+
+def check_bulk_swaps_in_order(c):
+    print("2. BULK SWAPS DEBIT IN ORDER")
+    print("-" * 50)
+    user_id = create_user(c, crypto_portfolio={"BTC": 1.0}, eur_balance=100.0)
+    response = c.post("/api/bulk/swaps", json={"items": [
+        {"user_id": user_id, "from_currency": "BTC", "to_currency": "ETH", "amount": 0.6},
+        {"user_id": user_id, "from_currency": "BTC", "to_currency": "ETH", "amount": 0.6},
+        {"user_id": user_id, "from_currency": "EUR", "to_currency": "BTC", "amount": 40},
+        {"user_id": user_id, "from_currency": "BTC", "to_currency": "BTC", "amount": 0.1}
+    ]}).json()
+    results = response["results"]
+    statuses = [result["status"] for result in results]
+    print(f"Statuses: {statuses}")
+
+    user = user_doc(c, user_id)
+    portfolio = user["crypto_portfolio"]
+    expected_btc = 1.0 - 0.6 + results[2]["receive_amount"]
+    print(f"BTC expected {expected_btc:.8f} actual {portfolio['BTC']:.8f}, EUR {user['eur_balance']}")
+    passed = (
+        statuses == ["applied", "rejected", "applied", "invalid"]
+        and "transaction_id" not in results[1]
+        and abs(portfolio["BTC"] - expected_btc) < 1e-9
+        and abs(portfolio["ETH"] - results[0]["receive_amount"]) < 1e-9
+        and user["eur_balance"] == 60.0 and "EUR" not in portfolio
+    )
+    return report(passed, "second debit rejected, fiat leg moved eur_balance",
+                  "debits were not applied in order")
+
+
+def check_conflict_retry(c):
+    print("3. CONCURRENT WRITE BETWEEN READ AND BULK WRITE")
+    print("-" * 50)
+    user_id = create_user(c)
+    CONCURRENT_WRITES.append(lambda: server.fiat_topup(user_id, "EUR", 1.0))
+    response = c.post("/api/bulk/topups", json={"items": [
+        {"user_id": user_id, "currency": "EUR", "amount": 10}
+    ]}).json()
+    result = response["results"][0]
+    print(f"Once: {result['status']}, new balance {result.get('new_balance')}")
+    retried = result["status"] == "applied" and result["new_balance"] == 11.0 \
+        and user_doc(c, user_id)["eur_balance"] == 11.0
+
+    CONCURRENT_WRITES.extend(lambda: server.fiat_topup(user_id, "EUR", 1.0)
+                             for _ in range(server.BULK_CONFLICT_RETRIES + 1))
+    response = c.post("/api/bulk/topups", json={"items": [
+        {"user_id": user_id, "currency": "EUR", "amount": 10}
+    ]}).json()
+    result = response["results"][0]
+    expected = 11.0 + server.BULK_CONFLICT_RETRIES + 1
+    print(f"Every attempt: {result['status']}, balance {user_doc(c, user_id)['eur_balance']} (expected {expected})")
+    exhausted = result["status"] == "conflict" and "transaction_id" not in result \
+        and "new_balance" not in result and user_doc(c, user_id)["eur_balance"] == expected
+
+    return report(retried and exhausted, "re-planned once, then reported conflict without applying",
+                  "conflicting write was lost or applied twice")
+
+
+def check_replanned_rejection(c):
+    print("4. RE-PLAN REJECTS AN ITEM THE FIRST PLAN APPLIED")
+    print("-" * 50)
+    user_id = create_user(c, crypto_portfolio={"BTC": 1.0})
+    # Another client's swap spends half the BTC after the bulk request planned its 0.6 debit
+    CONCURRENT_WRITES.append(lambda: server.crypto_swap(server.SwapRequest(
+        user_id=user_id, from_currency="BTC", to_currency="ETH", amount=0.5)))
+    response = c.post("/api/bulk/swaps", json={"items": [
+        {"user_id": user_id, "from_currency": "BTC", "to_currency": "ETH", "amount": 0.6}
+    ]}).json()
+    result = response["results"][0]
+    print(f"Result: {result}")
+    passed = result["status"] == "rejected" and "transaction_id" not in result and "new_balance" not in result \
+        and abs(user_doc(c, user_id)["crypto_portfolio"]["BTC"] - 0.5) < 1e-9
+    return report(passed, "rejected item carries no stale transaction_id", "re-planned rejection kept stale fields")
+
+
+def check_write_after_bulk_write(c):
+    print("5. WRITE LANDING AFTER A PARTIAL BULK WRITE")
+    print("-" * 50)
+    user_a, user_b = create_user(c), create_user(c)
+    # A's update misses (its document changed first); B's lands and is then changed by a single top-up
+    CONCURRENT_WRITES.append(lambda: server.fiat_topup(user_a, "EUR", 1.0))
+    LATE_WRITES.append(lambda: server.fiat_topup(user_b, "EUR", 1.0))
+    response = c.post("/api/bulk/topups", json={"items": [
+        {"user_id": user_a, "currency": "EUR", "amount": 10},
+        {"user_id": user_b, "currency": "EUR", "amount": 10}
+    ]}).json()
+    statuses = [result["status"] for result in response["results"]]
+    balances = [user_doc(c, user_id)["eur_balance"] for user_id in (user_a, user_b)]
+    print(f"Statuses: {statuses}, balances: {balances} (expected [11.0, 11.0])")
+    passed = statuses == ["applied", "applied"] and balances == [11.0, 11.0]
+    return report(passed, "only the user whose update missed was re-applied", "a landed update was applied twice")
+
+
+def check_ledger_sequence(c, user_ids):
+    print("6. LEDGER SEQUENCE AND RECONCILIATION")
+    print("-" * 50)
+    passed = True
+    for user_id in user_ids:
+        seqs = [t["seq"] for t in c.portal.call(
+            lambda: server.db.transactions.find({"user_id": user_id}).sort("seq", 1).to_list(None))]
+        reconciled = c.post(f"/api/users/{user_id}/ledger/reconcile").json()
+        ok = seqs == list(range(1, len(seqs) + 1)) and reconciled["reconciled"] and reconciled["seq"] == len(seqs)
+        print(f"{user_id[:8]}: {len(seqs)} transactions, ledger seq {reconciled['seq']}, "
+              f"reconciled {reconciled['reconciled']}")
+        passed = passed and ok
+    return report(passed, "every user's transactions are numbered 1..n and reconcile",
+                  "ledger sequence has gaps or does not reconcile")
+
+
+if __name__ == "__main__":
+    print("=" * 80)
+    print("BULK OPERATIONS TEST")
+    print("=" * 80)
+    print()
+
+    upstream = harness.start_upstream(UPSTREAM_PORT, latency=0.0)
+    harness.use_database("akka_bulk")
+    mongomock_motor.AsyncMongoMockCollection.bulk_write = stand_in_bulk_write
+    try:
+        with TestClient(server.app) as c:
+            c.portal.call(harness.wait_for_prices)
+            results = [check_bulk_topups(c), check_bulk_swaps_in_order(c), check_conflict_retry(c),
+                       check_replanned_rejection(c), check_write_after_bulk_write(c)]
+            users = c.portal.call(lambda: server.db.users.distinct("id"))
+            results.append(check_ledger_sequence(c, users))
+    finally:
+        upstream.should_exit = True
+    print(f"{sum(results)}/{len(results)} checks passed")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+CoinMarketCap Client Benchmark
+Measures latency of unrelated requests while /api/crypto/prices waits on a slow upstream.
+
+The bundled CoinMarketCap stand-in (backend/fake_coinmarketcap.py) is started with a
+fixed delay and the FastAPI app is driven in-process. The run is repeated with the old blocking `requests.get` call patched in,
+so the two event-loop behaviours can be compared side by side.
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import time
+
+import httpx
+import requests
+
+import harness
+from harness import server
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+UPSTREAM_HOST = "127.0.0.1"
+UPSTREAM_PORT = int(os.environ.get('BENCH_UPSTREAM_PORT', '8765'))
+UPSTREAM_DELAY = float(os.environ.get('BENCH_UPSTREAM_DELAY', '1.0'))
+SLOW_REQUESTS = int(os.environ.get('BENCH_SLOW_REQUESTS', '10'))
+FAST_REQUESTS = int(os.environ.get('BENCH_FAST_REQUESTS', '50'))
+
+async def blocking_get_crypto_prices(symbols: str = "BTC,ETH"):
+    """The pre-pool implementation: a synchronous request inside a coroutine"""
+    response = requests.get(
+        f"{server.COINMARKETCAP_BASE_URL}/cryptocurrency/quotes/latest",
+        params={"symbol": symbols, "convert": "USD"}
+    )
+    return response.json()["data"]
+
+async def run_scenario(label):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as api:
+        latencies = []
+        started = time.perf_counter()
+
+        async def timed_fast_request(arrival):
+            # Latency is measured from the scheduled arrival time, so time spent
+            # waiting for a blocked event loop is counted as well
+            await asyncio.sleep(max(0.0, arrival - (time.perf_counter() - started)))
+            await api.get("/api/exchange-rates")
+            latencies.append((time.perf_counter() - started - arrival) * 1000)
+
+        slow = [asyncio.create_task(api.get("/api/crypto/prices", params={"symbols": "BTC,ETH"}))
+                for _ in range(SLOW_REQUESTS)]
+        # Spread fast requests over the time the slow upstream calls are in flight
+        fast = [timed_fast_request(i * UPSTREAM_DELAY / FAST_REQUESTS) for i in range(FAST_REQUESTS)]
+        await asyncio.gather(*fast, *slow)
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<28} wall={wall:6.2f}s  fast p50={statistics.median(latencies):8.1f}ms  "
+          f"p95={p95:8.1f}ms  max={latencies[-1]:8.1f}ms")
+
+async def main():
+    server.CoinMarketCapService.start()
+
+    print("=" * 80)
+    print("COINMARKETCAP CLIENT BENCHMARK")
+    print("=" * 80)
+    print(f"Upstream delay: {UPSTREAM_DELAY}s, slow requests: {SLOW_REQUESTS}, fast requests: {FAST_REQUESTS}")
+    print(f"HTTP/2 enabled: {server.CMC_HTTP2}")
+    print()
+
+    await run_scenario("pooled async client")
+
+    original = server.CoinMarketCapService.get_crypto_prices
+    server.CoinMarketCapService.get_crypto_prices = staticmethod(blocking_get_crypto_prices)
+    try:
+        await run_scenario("blocking requests.get")
+    finally:
+        server.CoinMarketCapService.get_crypto_prices = original
+        await server.CoinMarketCapService.close()
+
+if __name__ == "__main__":
+    # The bundled CoinMarketCap stand-in, with a fixed delay on every response
+    upstream_server = harness.start_upstream(UPSTREAM_PORT, UPSTREAM_HOST, latency=UPSTREAM_DELAY)
+    try:
+        asyncio.run(main())
+    finally:
+        upstream_server.should_exit = True
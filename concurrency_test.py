@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Concurrency Stress Test for Akka Fintech
+Fires concurrent top-ups and swaps for one user and checks that no balance update is lost
+"""
+
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+# Load environment variables
+load_dotenv('/app/frontend/.env')
+load_dotenv('/app/backend/.env')
+
+# Get backend URL from environment
+BACKEND_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001')
+API_BASE_URL = f"{BACKEND_URL}/api"
+
+# Swaps need a crypto balance, which no API endpoint can fund, so it is seeded directly
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'akka_fintech')
+
+WORKERS = int(os.environ.get('STRESS_WORKERS', '32'))
+TOPUPS = int(os.environ.get('STRESS_TOPUPS', '200'))
+SWAPS = int(os.environ.get('STRESS_SWAPS', '200'))
+TOPUP_AMOUNT = 10.0
+SWAP_AMOUNT = 0.01
+# Enough BTC for only half of the swaps, so the balance guard is exercised as well
+SEED_BTC = SWAP_AMOUNT * SWAPS / 2
+
+print(f"Testing backend at: {API_BASE_URL}")
+
+def create_user():
+    response = requests.post(f"{API_BASE_URL}/users", json={
+        "email": f"stress-{uuid.uuid4().hex[:8]}@akka.test",
+        "name": "Stress Test"
+    })
+    response.raise_for_status()
+    return response.json()["id"]
+
+def topup(user_id):
+    response = requests.post(f"{API_BASE_URL}/users/{user_id}/topup",
+                             params={"currency": "EUR", "amount": TOPUP_AMOUNT})
+    return response.status_code
+
+def swap(user_id):
+    response = requests.post(f"{API_BASE_URL}/swap", json={
+        "user_id": user_id,
+        "from_currency": "BTC",
+        "to_currency": "ETH",
+        "amount": SWAP_AMOUNT
+    })
+    # 202: applied, but the transaction record was not written
+    return response.json() if response.status_code in (200, 202) else None
+
+def check_concurrent_topups(user_id):
+    print(f"1. {TOPUPS} CONCURRENT EUR TOP-UPS ({WORKERS} workers)")
+    print("-" * 50)
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        statuses = list(pool.map(topup, [user_id] * TOPUPS))
+
+    ok = statuses.count(200) + statuses.count(202)
+    user = requests.get(f"{API_BASE_URL}/users/{user_id}").json()
+    expected = ok * TOPUP_AMOUNT
+    passed = abs(user["eur_balance"] - expected) < 1e-6
+
+    print(f"Successful top-ups: {ok}/{TOPUPS}")
+    print(f"Expected balance: {expected:.2f}  Actual balance: {user['eur_balance']:.2f}")
+    print("✅ PASS - no lost updates" if passed else "❌ FAIL - top-ups were lost")
+    print()
+    return passed
+
+def check_concurrent_swaps(user_id, mongo_db):
+    print(f"2. {SWAPS} CONCURRENT BTC -> ETH SWAPS (seeded with {SEED_BTC} BTC)")
+    print("-" * 50)
+    mongo_db.users.update_one({"id": user_id}, {"$set": {"crypto_portfolio": {"BTC": SEED_BTC, "ETH": 0.0}}})
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        results = [r for r in pool.map(swap, [user_id] * SWAPS) if r is not None]
+
+    applied = [r for r in results if r.get("portfolio_updated")]
+    portfolio = requests.get(f"{API_BASE_URL}/users/{user_id}").json()["crypto_portfolio"]
+    expected_btc = SEED_BTC - len(applied) * SWAP_AMOUNT
+    expected_eth = sum(r["receive_amount"] for r in applied)
+
+    passed = (
+        portfolio["BTC"] >= -1e-9
+        and abs(portfolio["BTC"] - expected_btc) < 1e-9
+        and abs(portfolio["ETH"] - expected_eth) < 1e-9
+    )
+
+    print(f"Swaps answered: {len(results)}/{SWAPS}, applied to portfolio: {len(applied)}")
+    print(f"BTC expected {expected_btc:.8f} actual {portfolio['BTC']:.8f}")
+    print(f"ETH expected {expected_eth:.8f} actual {portfolio['ETH']:.8f}")
+    print("✅ PASS - balances conserved, no overdraft" if passed else "❌ FAIL - lost update or overdraft")
+    print()
+    return passed
+
+if __name__ == "__main__":
+    print("=" * 80)
+    print("PORTFOLIO CONCURRENCY STRESS TEST")
+    print("=" * 80)
+
+    mongo_db = MongoClient(MONGO_URL)[DB_NAME]
+    user_id = create_user()
+    print(f"Created user {user_id}")
+    print()
+
+    results = [check_concurrent_topups(user_id), check_concurrent_swaps(user_id, mongo_db)]
+    print(f"{sum(results)}/{len(results)} checks passed")
@@ -1003,12 +1003,47 @@ const SendModal = ({ onClose, onSendComplete, userBalances }) => {
   );
 };
 
+// Chart periods in days; the backend picks the candle interval for the range
+const CHART_PERIODS = { '7D': 7, '1M': 30, '3M': 90, '1Y': 365 };
+const PLACEHOLDER_CHART_PATH = 'M0,80 Q50,40 100,60 T200,50 T300,30 T400,45';
+
+// SVG line through candle closes, scaled to the chart box
+const candleChartPath = (candles, width, height) => {
+  if (candles.length < 2) return null;
+  const closes = candles.map(candle => candle.close);
+  const min = Math.min(...closes);
+  const range = Math.max(...closes) - min || 1;
+  return closes.map((close, i) => {
+    const x = (i / (closes.length - 1)) * width;
+    const y = height - 10 - ((close - min) / range) * (height - 20);
+    return `${i === 0 ? 'M' : 'L'}${x.toFixed(1)},${y.toFixed(1)}`;
+  }).join(' ');
+};
+
 // Crypto Details Modal Component
 const CryptoDetailsModal = ({ crypto, data, onClose, onBuy, onSell, cryptoPrices }) => {
+  const [chartPeriod, setChartPeriod] = useState('7D');
+  const [candles, setCandles] = useState([]);
+
+  useEffect(() => {
+    if (!crypto) return;
+    const start = new Date(Date.now() - CHART_PERIODS[chartPeriod] * 86400000).toISOString();
+    axios.get(`${API}/crypto/${crypto}/candles`, { params: { start } })
+      .then(response => setCandles(response.data.candles))
+      .catch(() => setCandles([]));
+  }, [crypto, chartPeriod]);
+
   if (!crypto || !data) return null;
 
   const cryptoPrice = cryptoPrices[crypto];
   const pricePerUnit = data.value / data.amount;
+  const chartPath = candleChartPath(candles, 400, 120) || PLACEHOLDER_CHART_PATH;
+  // Candles are in USD; scale them to the EUR price shown above
+  const lastClose = candles.length ? candles[candles.length - 1].close : null;
+  const dayAgo = new Date(Date.now() - 86400000).toISOString().slice(0, 19);
+  const lastDay = candles.filter(candle => candle.start >= dayAgo);
+  const high24h = lastDay.length ? Math.max(...lastDay.map(c => c.high)) * pricePerUnit / lastClose : pricePerUnit * 1.03;
+  const low24h = lastDay.length ? Math.min(...lastDay.map(c => c.low)) * pricePerUnit / lastClose : pricePerUnit * 0.97;
   
   return (
     <div className="modal-overlay">
@@ -1044,12 +1079,17 @@ const CryptoDetailsModal = ({ crypto, data, onClose, onBuy, onSell, cryptoPrices
           {/* Price Chart Placeholder */}
           <div className="price-chart-section">
             <div className="chart-header">
-              <h4>📈 Price Chart (7 Days)</h4>
+              <h4>📈 Price Chart ({chartPeriod})</h4>
               <div className="chart-period-tabs">
-                <button className="period-tab active">7D</button>
-                <button className="period-tab">1M</button>
-                <button className="period-tab">3M</button>
-                <button className="period-tab">1Y</button>
+                {Object.keys(CHART_PERIODS).map(period => (
+                  <button
+                    key={period}
+                    className={`period-tab ${chartPeriod === period ? 'active' : ''}`}
+                    onClick={() => setChartPeriod(period)}
+                  >
+                    {period}
+                  </button>
+                ))}
               </div>
             </div>
             <div className="chart-placeholder">
@@ -1060,21 +1100,21 @@ const CryptoDetailsModal = ({ crypto, data, onClose, onBuy, onSell, cryptoPrices
                     <stop offset="100%" stopColor="#10B981" stopOpacity="0.05"/>
                   </linearGradient>
                 </defs>
-                <path d="M0,80 Q50,40 100,60 T200,50 T300,30 T400,45" 
+                <path d={chartPath}
                       stroke="#10B981" 
                       strokeWidth="3" 
                       fill="none"/>
-                <path d="M0,80 Q50,40 100,60 T200,50 T300,30 T400,45 L400,120 L0,120 Z" 
+                <path d={`${chartPath} L400,120 L0,120 Z`}
                       fill="url(#priceGradient)"/>
               </svg>
               <div className="chart-stats">
                 <div className="stat-item">
                   <span className="stat-label">24h High</span>
-                  <span className="stat-value">€{(pricePerUnit * 1.03).toLocaleString()}</span>
+                  <span className="stat-value">€{high24h.toLocaleString(undefined, {maximumFractionDigits: 2})}</span>
                 </div>
                 <div className="stat-item">
                   <span className="stat-label">24h Low</span>
-                  <span className="stat-value">€{(pricePerUnit * 0.97).toLocaleString()}</span>
+                  <span className="stat-value">€{low24h.toLocaleString(undefined, {maximumFractionDigits: 2})}</span>
                 </div>
               </div>
             </div>
@@ -2174,6 +2214,24 @@ const MainApp = () => {
 
   useEffect(() => {
     fetchCryptoPrices();
+
+    // Live price deltas from the backend stream; poll only where EventSource is unavailable
+    if (window.EventSource) {
+      const source = new EventSource(`${API}/crypto/stream?symbols=${FEATURED_CRYPTOS.join(',')}`);
+      source.onmessage = (event) => {
+        const { prices } = JSON.parse(event.data);
+        const eurPrices = {};
+        Object.keys(prices).forEach(symbol => {
+          eurPrices[symbol] = {
+            ...prices[symbol],
+            price: prices[symbol].price * 0.92 // USD to EUR conversion
+          };
+        });
+        setCryptoPrices(current => ({ ...current, ...eurPrices }));
+      };
+      return () => source.close();
+    }
+
     const interval = setInterval(fetchCryptoPrices, 30000);
     return () => clearInterval(interval);
   }, []);
@@ -2659,20 +2717,6 @@ const MainApp = () => {
     }
   }, [swiperInstance]);
 
-  // Simulate price updates (in real app, this would come from WebSocket or API polling)
-  useEffect(() => {
-    const interval = setInterval(() => {
-      if (Object.keys(cryptoPrices).length > 0) {
-        // Add small random variations to simulate live prices (±0.5%)
-        const variation = (Math.random() - 0.5) * 0.01; // ±0.5%
-        // This is just for demonstration - real implementation would fetch from API
-        console.log('Price variation simulation:', variation);
-      }
-    }, 30000); // Update every 30 seconds for demo
-
-    return () => clearInterval(interval);
-  }, [cryptoPrices]);
-
   if (loading) {
     return (
       <div className="akka-loading">
@@ -0,0 +1,64 @@
+"""
+Shared setup for the scripts that drive server.py in-process
+(load_test.py, transaction_write_benchmark.py, cmc_client_benchmark.py,
+bulk_operations_test.py, user_import_test.py).
+
+Importing it puts backend/ on the path and points the CoinMarketCap id map at a
+temporary file: the app's startup hooks refresh the map from whatever upstream
+the script uses, and that copy must not end up in backend/cmc_id_map.json.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import server  # noqa: E402
+import fake_coinmarketcap  # noqa: E402
+
+ID_MAP_DIR = tempfile.TemporaryDirectory()
+server.symbol_index.path = Path(ID_MAP_DIR.name) / "cmc_id_map.json"
+
+
+def use_database(prefix, mongo_url=None, mongo_url_env=None):
+    """Point server.py at a fresh database; returns a callable that drops it.
+
+    A real server when mongo_url is set, otherwise the in-memory stand-in (mongomock-motor).
+    """
+    name = f"{prefix}_{uuid.uuid4().hex[:8]}"
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo = AsyncIOMotorClient(mongo_url)
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is not installed: pip install mongomock-motor"
+                     + (f", or set {mongo_url_env}" if mongo_url_env else ""))
+        mongo = AsyncMongoMockClient()
+    server.client = mongo
+    server.db = mongo[name]
+    return lambda: mongo.drop_database(name)
+
+
+def start_upstream(port, host="127.0.0.1", **config):
+    """Serve the CoinMarketCap stand-in in a thread and point server.py at it; set should_exit to stop it"""
+    upstream = fake_coinmarketcap.serve_in_thread(
+        fake_coinmarketcap.create_app(fake_coinmarketcap.FakeConfig(**config)), host, port)
+    server.COINMARKETCAP_BASE_URL = f"http://{host}:{port}/v1"
+    return upstream
+
+
+async def wait_for_prices():
+    """Wait for the first ingestion snapshot; swaps are priced from it"""
+    while server.price_worker.snapshot is None:
+        await asyncio.sleep(0.05)
+
+
+def report(passed, success, failure):
+    print(f"✅ PASS - {success}" if passed else f"❌ FAIL - {failure}")
+    print()
+    return passed
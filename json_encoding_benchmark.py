@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+JSON Encoding Microbenchmark
+Compares the default FastAPI response path (Pydantic models + jsonable_encoder + json.dumps)
+with the compact path used by hot endpoints (plain dicts encoded by dumps_json)
+"""
+
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import server  # noqa: E402
+
+ROWS = int(os.environ.get('BENCH_ROWS', '100'))
+REPEAT = int(os.environ.get('BENCH_REPEAT', '200'))
+
+def sample_transactions(count):
+    """Rows shaped like the documents read back from Mongo"""
+    now = datetime.utcnow()
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": "bench-user",
+            "transaction_type": "crypto_swap",
+            "from_currency": "BTC",
+            "to_currency": "ETH",
+            "from_amount": 0.1,
+            "to_amount": 1.99,
+            "exchange_rate": 20.0,
+            "timestamp": now - timedelta(minutes=i)
+        }
+        for i in range(count)
+    ]
+
+def sample_prices():
+    return {
+        symbol: {"symbol": symbol, "name": symbol, "price": 123.45, "change_24h": 1.2,
+                 "market_cap": 1.0e9, "volume_24h": 1.0e8}
+        for symbol in server.FEATURED_CRYPTOS
+    }
+
+def default_transactions(rows):
+    return json.dumps(jsonable_encoder({"transactions": [server.Transaction(**t) for t in rows]})).encode()
+
+def fast_transactions(rows):
+    return server.dumps_json({"transactions": rows, "next_cursor": None})
+
+def default_prices(prices):
+    return json.dumps(jsonable_encoder({"prices": prices, "timestamp": datetime.utcnow().isoformat()})).encode()
+
+def fast_prices(prices):
+    return server.dumps_json({"prices": prices, "timestamp": datetime.utcnow().isoformat()})
+
+def measure(label, fn, arg):
+    seconds = min(timeit.repeat(lambda: fn(arg), number=REPEAT, repeat=3)) / REPEAT
+    tracemalloc.start()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<44} {seconds * 1e6:10.1f} µs/call  peak alloc {peak / 1024:8.1f} KiB")
+    return seconds
+
+if __name__ == "__main__":
+    print("=" * 80)
+    print("JSON ENCODING MICROBENCHMARK")
+    print("=" * 80)
+    print(f"Encoder: {'orjson' if server.orjson is not None else 'stdlib json'}, "
+          f"transaction rows: {ROWS}, calls per sample: {REPEAT}")
+    print()
+
+    rows = sample_transactions(ROWS)
+    slow = measure("transactions: Transaction + jsonable_encoder", default_transactions, rows)
+    fast = measure("transactions: raw rows + dumps_json", fast_transactions, rows)
+    print(f"{'speed-up':<44} {slow / fast:10.1f}x")
+    print()
+
+    prices = sample_prices()
+    slow = measure("prices: jsonable_encoder + json.dumps", default_prices, prices)
+    fast = measure("prices: dumps_json", fast_prices, prices)
+    print(f"{'speed-up':<44} {slow / fast:10.1f}x")
+    print("(cached snapshot bodies skip encoding entirely after the first request)")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Load Test and Benchmark Suite for Akka Fintech
+Drives a mixed workload (price polling, swaps, top-ups, history reads) against the
+FastAPI app in-process, with the bundled CoinMarketCap stand-in as price upstream.
+
+Each concurrency level runs for a fixed time with closed-loop virtual clients, and
+p50/p95/p99 latency and throughput are reported per endpoint. Results are written
+as JSON tagged with the git commit; set LOAD_BASELINE to an earlier result file to
+print the change against it.
+
+Mongo: an in-memory stand-in (mongomock-motor) by default, or a real server when
+LOAD_MONGO_URL is set. The run's database is dropped afterwards.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+import harness
+from harness import server
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("server").setLevel(logging.WARNING)
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CONCURRENCY_LEVELS = [int(c) for c in os.environ.get('LOAD_CONCURRENCY', '1,8,32').split(',')]
+DURATION = float(os.environ.get('LOAD_DURATION', '10'))
+WARMUP = float(os.environ.get('LOAD_WARMUP', '1'))
+USERS = int(os.environ.get('LOAD_USERS', '20'))
+SEED = int(os.environ.get('LOAD_SEED', '42'))
+# Relative weights of the operations in the mix
+MIX = dict(
+    (name, float(weight)) for name, weight in
+    (item.split(':') for item in os.environ.get('LOAD_MIX', 'prices:50,history:20,topup:15,swap:15').split(','))
+)
+MONGO_URL = os.environ.get('LOAD_MONGO_URL')
+UPSTREAM_PORT = int(os.environ.get('LOAD_UPSTREAM_PORT', '8766'))
+UPSTREAM_LATENCY = float(os.environ.get('LOAD_UPSTREAM_LATENCY', '0.05'))
+UPSTREAM_JITTER = float(os.environ.get('LOAD_UPSTREAM_JITTER', '0.02'))
+OUTPUT_DIR = os.environ.get('LOAD_OUTPUT_DIR', os.path.join(REPO_DIR, 'load_results'))
+BASELINE = os.environ.get('LOAD_BASELINE')
+
+PRICE_SYMBOLS = ["BTC,ETH,SOL", "BTC,ETH,BNB,ADA,XRP", ",".join(server.FEATURED_CRYPTOS[:10])]
+SEED_PORTFOLIO = {"BTC": 1000.0, "ETH": 10000.0, "SOL": 0.0}
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+# Workload
+async def op_prices(api, rng, user_id):
+    return "GET /api/crypto/prices", await api.get("/api/crypto/prices", params={"symbols": rng.choice(PRICE_SYMBOLS)})
+
+async def op_history(api, rng, user_id):
+    return "GET /api/users/{id}/transactions", await api.get(f"/api/users/{user_id}/transactions", params={"limit": 50})
+
+async def op_topup(api, rng, user_id):
+    currency = rng.choice(["EUR", "TRY"])
+    return "POST /api/users/{id}/topup", await api.post(f"/api/users/{user_id}/topup",
+                                                        params={"currency": currency, "amount": 10.0})
+
+async def op_swap(api, rng, user_id):
+    from_currency, to_currency = rng.choice([("BTC", "ETH"), ("ETH", "BTC"), ("ETH", "SOL")])
+    return "POST /api/swap", await api.post("/api/swap", json={
+        "user_id": user_id, "from_currency": from_currency, "to_currency": to_currency, "amount": 0.001
+    })
+
+OPERATIONS = {"prices": op_prices, "history": op_history, "topup": op_topup, "swap": op_swap}
+
+
+async def seed_users(api):
+    user_ids = []
+    for i in range(USERS):
+        response = await api.post("/api/users", json={"email": f"load-{uuid.uuid4().hex[:8]}@akka.test",
+                                                     "name": f"Load User {i}"})
+        response.raise_for_status()
+        user_ids.append(response.json()["id"])
+    # No endpoint funds a crypto balance, so portfolios are seeded directly
+    await server.db.users.update_many({"id": {"$in": user_ids}}, {"$set": {"crypto_portfolio": SEED_PORTFOLIO}})
+    for user_id in user_ids:
+        server.user_cache.invalidate(user_id)
+    return user_ids
+
+
+async def run_level(api, user_ids, concurrency):
+    """Closed loop: each client issues its next request as soon as the previous one returns"""
+    names = [name for name in MIX if MIX[name] > 0]
+    weights = [MIX[name] for name in names]
+    samples = {}
+    # Time-based rather than an Event: in-memory Mongo calls may never yield to the loop
+    measure_from = time.perf_counter() + WARMUP
+    deadline = measure_from + DURATION
+
+    async def client(index):
+        rng = random.Random(SEED * 1000 + index)
+        while time.perf_counter() < deadline:
+            operation = OPERATIONS[rng.choices(names, weights)[0]]
+            started = time.perf_counter()
+            try:
+                label, response = await operation(api, rng, rng.choice(user_ids))
+                status = response.status_code
+            except Exception as e:
+                label, status = operation.__name__, type(e).__name__
+            elapsed = time.perf_counter() - started
+            if started >= measure_from:
+                entry = samples.setdefault(label, {"latencies": [], "errors": 0})
+                entry["latencies"].append(elapsed)
+                if status != 200:
+                    entry["errors"] += 1
+
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return {label: summarize(entry["latencies"], entry["errors"]) for label, entry in sorted(samples.items())}
+
+
+def summarize(latencies, errors):
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"requests": len(latencies), "errors": errors, "throughput": len(latencies) / DURATION,
+            "mean_ms": float(ms.mean()), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "max_ms": float(ms.max())}
+
+
+def print_level(concurrency, endpoints, baseline=None):
+    print(f"Concurrency {concurrency}")
+    print(f"  {'endpoint':<36} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for label, stats in endpoints.items():
+        line = (f"  {label:<36} {stats['throughput']:8.1f} {stats['p50_ms']:8.2f} "
+                f"{stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f} {stats['errors']:7d}")
+        previous = (baseline or {}).get(label)
+        if previous:
+            p95_change = (stats['p95_ms'] / previous['p95_ms'] - 1) * 100 if previous['p95_ms'] else 0.0
+            rate_change = (stats['throughput'] / previous['throughput'] - 1) * 100 if previous['throughput'] else 0.0
+            line += f"   vs baseline: p95 {p95_change:+6.1f}%  req/s {rate_change:+6.1f}%"
+        print(line)
+    print()
+
+
+async def main():
+    baseline = None
+    if BASELINE:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        print(f"Baseline: {BASELINE} (commit {baseline['git']['commit']})")
+
+    drop_database = harness.use_database("akka_load", MONGO_URL, "LOAD_MONGO_URL")
+    results = []
+
+    transport = httpx.ASGITransport(app=server.app)
+    # The lifespan context runs the app's startup/shutdown hooks (indexes, pools, ingestion)
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=30.0) as api:
+            user_ids = await seed_users(api)
+            for concurrency in CONCURRENCY_LEVELS:
+                endpoints = await run_level(api, user_ids, concurrency)
+                baseline_level = next((level["endpoints"] for level in (baseline or {}).get("levels", [])
+                                       if level["concurrency"] == concurrency), None)
+                print_level(concurrency, endpoints, baseline_level)
+                results.append({"concurrency": concurrency, "endpoints": endpoints})
+    await drop_database()
+    return results
+
+
+if __name__ == "__main__":
+    print("=" * 80)
+    print("AKKA FINTECH LOAD TEST")
+    print("=" * 80)
+    revision = git_revision()
+    print(f"Commit: {revision['commit']}{' (dirty)' if revision['dirty'] else ''}")
+    print(f"Levels: {CONCURRENCY_LEVELS}, {DURATION}s each after {WARMUP}s warm-up, {USERS} users, mix {MIX}")
+    print(f"Mongo: {'server at LOAD_MONGO_URL' if MONGO_URL else 'in-memory stand-in'}, "
+          f"upstream latency {UPSTREAM_LATENCY}s ± {UPSTREAM_JITTER}s")
+    print()
+
+    upstream = harness.start_upstream(UPSTREAM_PORT, latency=UPSTREAM_LATENCY, jitter=UPSTREAM_JITTER, seed=SEED)
+    try:
+        levels = asyncio.run(main())
+    finally:
+        upstream.should_exit = True
+
+    report = {
+        "git": revision,
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"concurrency": CONCURRENCY_LEVELS, "duration": DURATION, "warmup": WARMUP, "users": USERS,
+                   "mix": MIX, "seed": SEED, "mongo": "server" if MONGO_URL else "in-memory",
+                   "upstream_latency": UPSTREAM_LATENCY, "upstream_jitter": UPSTREAM_JITTER},
+        "levels": levels
+    }
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    short = (revision["commit"] or "nogit")[:10]
+    path = os.path.join(OUTPUT_DIR, f"load-{short}-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {path}")
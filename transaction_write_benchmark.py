@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Transaction Write Benchmark
+Drives bursts of concurrent swaps through the /api/swap handler and compares the
+three transaction record write modes of server.TransactionWriter:
+
+    direct  one insert_one per request, before responding
+    group   queued, response after the batch's insert_many is acknowledged
+    async   queued, response as soon as the record is queued
+
+Mongo: a real server when BENCH_MONGO_URL is set. Otherwise the in-memory stand-in
+(mongomock-motor) is used, and every collection call holds one of BENCH_MONGO_POOL
+connections for BENCH_MONGO_RTT seconds, standing in for the round trip and
+write-concern wait a real deployment pays per command.
+
+The handler is called directly rather than over HTTP, so the numbers reflect the
+write path rather than request parsing and middleware.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+import numpy as np
+from fastapi import HTTPException
+
+import harness
+from harness import server
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("server").setLevel(logging.ERROR)
+
+MODES = os.environ.get('BENCH_MODES', 'direct,group,async').split(',')
+SWAPS = int(os.environ.get('BENCH_SWAPS', '5000'))
+CONCURRENCY = int(os.environ.get('BENCH_CONCURRENCY', '200'))
+USERS = int(os.environ.get('BENCH_USERS', '20'))
+MONGO_URL = os.environ.get('BENCH_MONGO_URL')
+MONGO_RTT = float(os.environ.get('BENCH_MONGO_RTT', '0.002'))
+MONGO_POOL = int(os.environ.get('BENCH_MONGO_POOL', '10'))
+UPSTREAM_PORT = int(os.environ.get('BENCH_UPSTREAM_PORT', '8767'))
+
+
+def use_database():
+    """Point server.py at the run's database; returns a callable that drops it"""
+    drop_database = harness.use_database("akka_bench", MONGO_URL, "BENCH_MONGO_URL")
+    if not MONGO_URL:
+        import mongomock_motor
+        add_round_trip(mongomock_motor.AsyncMongoMockCollection)
+        # The stand-in enforces unique indexes with a scan of the whole collection on
+        # every write, which would swamp the round trips being compared
+        server.DB_INDEXES = []
+    return drop_database
+
+
+def add_round_trip(collection_class):
+    """Make the in-memory collection's write and lookup calls wait for a pooled connection and a round trip"""
+    pool = None
+
+    for method in ("insert_one", "insert_many", "find_one", "find_one_and_update"):
+        original = getattr(collection_class, method)
+
+        async def delayed(self, *args, _original=original, **kwargs):
+            nonlocal pool
+            if pool is None:
+                pool = asyncio.Semaphore(MONGO_POOL)
+            async with pool:
+                await asyncio.sleep(MONGO_RTT)
+            return await _original(self, *args, **kwargs)
+        setattr(collection_class, method, delayed)
+
+
+async def seed_users():
+    users = [server.User(email=f"bench-{uuid.uuid4().hex[:8]}@akka.test", name=f"Bench User {i}",
+                         crypto_portfolio={"BTC": 1.0e6}).dict() for i in range(USERS)]
+    await server.db.users.insert_many(users)
+    return [user["id"] for user in users]
+
+
+async def run_mode(user_ids, mode):
+    server.transaction_writer.mode = mode
+    before = await server.db.transactions.count_documents({})
+    batches_before = server.transaction_writer.batches
+    latencies = []
+    errors = 0
+    next_swap = 0
+
+    async def client(index):
+        nonlocal errors, next_swap
+        while next_swap < SWAPS:
+            user_id = user_ids[next_swap % len(user_ids)]
+            next_swap += 1
+            started = time.perf_counter()
+            try:
+                await server.crypto_swap(server.SwapRequest(
+                    user_id=user_id, from_currency="BTC", to_currency="ETH", amount=0.0001))
+            except HTTPException:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(CONCURRENCY)))
+    wall = time.perf_counter() - started
+    # Async mode answers before the write: wait for the queue to drain before counting
+    while server.transaction_writer.depth():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(server.transaction_writer.flush_interval * 2)
+    written = await server.db.transactions.count_documents({}) - before
+    batches = server.transaction_writer.batches - batches_before
+
+    ms = np.array(latencies) * 1000
+    p50, p99 = np.percentile(ms, [50, 99])
+    print(f"{mode:<8} {len(latencies) / wall:10.0f} swaps/s  p50={p50:7.2f}ms  p99={p99:7.2f}ms  "
+          f"errors={errors}  records={written}  inserts={batches if mode != 'direct' else written}")
+    return len(latencies) / wall
+
+
+async def main():
+    drop_database = use_database()
+    # The lifespan context starts the transaction writer and price ingestion
+    async with server.app.router.lifespan_context(server.app):
+        await harness.wait_for_prices()
+        user_ids = await seed_users()
+        rates = {mode: await run_mode(user_ids, mode) for mode in MODES}
+    await drop_database()
+
+    if "direct" in rates:
+        print()
+        for mode, rate in rates.items():
+            if mode != "direct":
+                print(f"{mode} vs direct: {rate / rates['direct']:.2f}x throughput")
+
+
+if __name__ == "__main__":
+    print("=" * 80)
+    print("TRANSACTION WRITE BENCHMARK")
+    print("=" * 80)
+    print(f"Swaps per mode: {SWAPS}, concurrency: {CONCURRENCY}, users: {USERS}, "
+          f"batch size: {server.TRANSACTION_BATCH_SIZE}, flush interval: {server.TRANSACTION_FLUSH_INTERVAL}s")
+    print(f"Mongo: {'server at BENCH_MONGO_URL' if MONGO_URL else f'in-memory stand-in, {MONGO_RTT * 1000:.1f}ms per call'}"
+          f"{'' if MONGO_URL else f' over {MONGO_POOL} connections'}")
+    print()
+
+    upstream = harness.start_upstream(UPSTREAM_PORT, latency=0.0)
+    try:
+        asyncio.run(main())
+    finally:
+        upstream.should_exit = True
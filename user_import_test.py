@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+User Import Test for Akka Fintech
+Checks the NDJSON user import (/api/users/import): line splitting across upload
+chunk boundaries, discarding of oversized lines, and email de-duplication within
+the upload and against existing users.
+
+Runs in-process against the in-memory Mongo stand-in (mongomock-motor), with a
+small line limit and chunk size so the boundaries are easy to hit.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+
+from fastapi.testclient import TestClient
+
+import harness
+from harness import report, server
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("server").setLevel(logging.ERROR)
+
+MAX_LINE_BYTES = 64
+CHUNK_SIZE = 2
+
+
+def split_lines(chunks):
+    """Numbered lines ndjson_lines yields for a body uploaded in these chunks"""
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [entry async for entry in server.ndjson_lines(stream())]
+    return asyncio.run(collect())
+
+
+def user_line(email, name="Import Test"):
+    return json.dumps({"email": email, "name": name}).encode() + b"\n"
+
+
+def check_chunk_boundaries():
+    print("1. LINES SPLIT ACROSS CHUNK BOUNDARIES")
+    print("-" * 50)
+    body = user_line("a@akka.test") + b"\n" + user_line("b@akka.test") + b'{"email": "c@akka.test", "name": "C"}'
+    expected = [(1, body.split(b"\n")[0]), (2, b""), (3, body.split(b"\n")[2]), (4, body.split(b"\n")[3])]
+
+    whole = split_lines([body])
+    mid_line = split_lines([body[:10], body[10:45], body[45:]])
+    byte_by_byte = split_lines([body[i:i + 1] for i in range(len(body))])
+    print(f"Whole body: {len(whole)} lines, three chunks: {len(mid_line)}, byte by byte: {len(byte_by_byte)}")
+    passed = whole == mid_line == byte_by_byte == expected
+    return report(passed, "same numbered lines however the body is chunked, final line without newline kept",
+                  "line splitting depends on chunk boundaries")
+
+
+def check_oversized_lines():
+    print(f"2. LINES LONGER THAN {MAX_LINE_BYTES} BYTES")
+    print("-" * 50)
+    long_line = b'{"email": "long@akka.test", "name": "' + b"x" * 100 + b'"}'
+    short = user_line("short@akka.test")
+
+    in_one_chunk = split_lines([long_line + b"\n" + short])
+    across_chunks = split_lines([long_line[i:i + 16] for i in range(0, len(long_line), 16)] + [b"\n" + short])
+    at_end = split_lines([short + long_line[:50], long_line[50:]])
+    print(f"In one chunk: {[line is None for _, line in in_one_chunk]}")
+    print(f"Across chunks: {[line is None for _, line in across_chunks]}")
+    print(f"Final line: {[line is None for _, line in at_end]}")
+    passed = (
+        in_one_chunk == [(1, None), (2, short.rstrip(b"\n"))]
+        and across_chunks == [(1, None), (2, short.rstrip(b"\n"))]
+        and at_end == [(1, short.rstrip(b"\n")), (2, None)]
+    )
+    return report(passed, "oversized lines come back as None, the next line is intact",
+                  "oversized line was kept or swallowed its neighbour")
+
+
+def check_import_endpoint(c):
+    print(f"3. IMPORT ENDPOINT (chunks of {CHUNK_SIZE} users)")
+    print("-" * 50)
+    tag = uuid.uuid4().hex[:8]
+    existing = f"existing-{tag}@akka.test"
+    c.post("/api/users", json={"email": existing, "name": "Existing"})
+    body = b"".join([
+        user_line(f"one-{tag}@akka.test"),
+        user_line(f"one-{tag}@akka.test"),           # duplicate within the chunk
+        user_line(existing),                          # already in the database
+        b"not json\n",
+        b'{"name": "No Email"}\n',
+        b"\n",
+        b'{"email": "x@akka.test", "name": "' + b"x" * 100 + b'"}\n',
+        user_line(f"two-{tag}@akka.test"),
+        user_line(f"one-{tag}@akka.test"),           # duplicate of an earlier chunk
+        user_line(f"three-{tag}@akka.test"),
+    ])
+    response = c.post("/api/users/import", content=(body[i:i + 7] for i in range(0, len(body), 7)))
+    summary = response.json()
+    print(f"Summary: { {k: v for k, v in summary.items() if k not in ('errors', 'elapsed_seconds')} }")
+    print(f"Errors: {summary['errors']}")
+
+    stored = c.portal.call(lambda: server.db.users.find({"email": {"$regex": tag}}, {"_id": 0, "email": 1})
+                           .to_list(None))
+    emails = sorted(user["email"] for user in stored)
+    print(f"Stored: {emails}")
+    passed = (
+        response.status_code == 200
+        and summary["lines"] == 10
+        and summary["imported"] == 3
+        and summary["duplicates"] == 3
+        and summary["invalid"] == 3
+        and [error["line"] for error in summary["errors"]] == [4, 5, 7]
+        and emails == sorted([existing, f"one-{tag}@akka.test", f"two-{tag}@akka.test", f"three-{tag}@akka.test"])
+    )
+    return report(passed, "each email stored once, invalid and oversized lines reported by number",
+                  "unexpected import counts or stored users")
+
+
+if __name__ == "__main__":
+    print("=" * 80)
+    print("USER IMPORT TEST")
+    print("=" * 80)
+    print()
+
+    server.IMPORT_MAX_LINE_BYTES = MAX_LINE_BYTES
+    server.IMPORT_CHUNK_SIZE = CHUNK_SIZE
+    # Only the import is exercised, so the price ingestion worker is left off
+    server.PRICE_INGESTION_ENABLED = False
+    harness.use_database("akka_import")
+
+    results = [check_chunk_boundaries(), check_oversized_lines()]
+    with TestClient(server.app) as c:
+        results.append(check_import_endpoint(c))
+    print(f"{sum(results)}/{len(results)} checks passed")